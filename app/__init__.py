@@ -10,6 +10,7 @@ from flask_cors import CORS
 from .services.sevice_manager import ServiceManager
 import logging
 from .model_loader import get_model, get_device
+from .json_provider import OrjsonProvider
 
 def create_app(config=None):
     """
@@ -20,6 +21,8 @@ def create_app(config=None):
     """
     # Création de l'instance Flask
     app = Flask(__name__)
+    # Sérialisation des réponses JSON par orjson
+    app.json = OrjsonProvider(app)
 
 
     CORS(app, resources={r"/*": {
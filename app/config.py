@@ -18,6 +18,15 @@ def setup_config(app):
     app.config['PDF_FOLDER'] = os.path.abspath(os.getenv('PDF_FOLDER', 'pdf'))
     app.config['IMAGE_FOLDER'] = os.path.abspath(os.getenv('IMAGE_FOLDER', 'images'))
 
+    # Délégation du service des fichiers au reverse proxy (X-Accel-Redirect de nginx) :
+    # préfixes des locations internes, send_from_directory est utilisé s'ils ne sont pas définis
+    app.config['X_ACCEL_PDF_PREFIX'] = os.getenv('X_ACCEL_PDF_PREFIX')
+    app.config['X_ACCEL_IMAGE_PREFIX'] = os.getenv('X_ACCEL_IMAGE_PREFIX')
+
+    # Durée de mise en cache navigateur des images (secondes) : les couvertures pouvant être
+    # remplacées sous le même nom, elles ne sont pas déclarées immutables et restent revalidables
+    app.config['IMAGE_CACHE_MAX_AGE'] = int(os.getenv('IMAGE_CACHE_MAX_AGE', 86400))
+
     # Clés API des modèles LLM
     app.config['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
     app.config['TOGETHER_API_KEY'] = os.getenv('TOGETHER_API_KEY')
@@ -34,6 +43,13 @@ def setup_config(app):
     # Configuration AI
     app.config['AI_MODEL_TYPE'] = os.getenv('AI_MODEL_TYPE', 'vllm_openai')
     app.config['AI_MODEL_TYPE_FOR_RESPONSE'] = os.getenv('AI_MODEL_TYPE_FOR_RESPONSE', 'vllm_openai')
+
+    # Seuils de score du filtrage LLM (désactivés si non définis) : au-dessus de KEEP_ABOVE
+    # un passage est conservé, en dessous de DROP_BELOW il est écarté, sans appel au LLM
+    keep_above = os.getenv('LLM_FILTER_KEEP_ABOVE')
+    drop_below = os.getenv('LLM_FILTER_DROP_BELOW')
+    app.config['LLM_FILTER_KEEP_ABOVE'] = float(keep_above) if keep_above else None
+    app.config['LLM_FILTER_DROP_BELOW'] = float(drop_below) if drop_below else None
     
     # Configurations spécifiques aux modèles
     # OpenAI
@@ -56,6 +72,9 @@ def setup_config(app):
     if not os.path.exists(app.config['PDF_FOLDER']):
         os.makedirs(app.config['PDF_FOLDER'])
 
+    # Préfixe résolu du répertoire des PDFs, calculé une fois pour le contrôle de serve_pdf
+    app.config['PDF_ROOT_PREFIX'] = os.path.realpath(app.config['PDF_FOLDER']) + os.sep
+
     # Validation des configurations requises (SECRET_KEY maintenant optionnel avec valeur par défaut)
     # Aucune validation critique nécessaire
     
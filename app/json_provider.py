@@ -0,0 +1,73 @@
+"""
+Module de sérialisation JSON des réponses de l'application RAG API.
+
+Ce module fournit un fournisseur JSON Flask basé sur orjson, nettement plus rapide que
+le module json standard pour les réponses volumineuses composées de listes de flottants
+(descriptions, similarités, correspondances). Il conserve le comportement du fournisseur
+par défaut de Flask : tri des clés, conversion des dates, UUID et dataclasses, et
+sérialisation standard pour les options qu'orjson ne prend pas en charge.
+
+Le fournisseur est installé pour toute l'application : flask.json.dumps produit
+désormais un JSON compact (sans espace après « , » et « : »), comme jsonify hors mode
+debug, et ni l'un ni l'autre n'échappent plus les caractères non ASCII, écrits
+directement en UTF-8.
+"""
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+# Séparateurs passés par Flask hors mode debug, équivalents à la sortie d'orjson
+COMPACT_SEPARATORS = (",", ":")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Fournisseur JSON Flask utilisant orjson pour sérialiser les réponses.
+
+    Les tableaux et scalaires NumPy sont sérialisés directement. Les options passées par
+    Flask (séparateurs compacts, indentation de 2 en mode debug) sont traduites en options
+    orjson ; les autres options du module json (cls, ensure_ascii...) et les valeurs hors
+    du domaine d'orjson (entiers de plus de 64 bits) reviennent au fournisseur par défaut.
+    """
+
+    def dumps(self, obj, **kwargs):
+        """
+        Sérialise obj en chaîne JSON.
+
+        Args:
+            obj: Objet à sérialiser
+            **kwargs: Options transmises à json.dumps par le fournisseur par défaut
+
+        Returns:
+            str: Document JSON
+        """
+        # Les dates passent par le default de Flask (format HTTP) pour ne pas changer l'API
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        options = dict(kwargs)
+        if options.pop('separators', COMPACT_SEPARATORS) != COMPACT_SEPARATORS:
+            return super().dumps(obj, **kwargs)
+        indent = options.pop('indent', None)
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if options or indent not in (None, 2):
+            return super().dumps(obj, **kwargs)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        """
+        Désérialise une chaîne ou des octets JSON.
+
+        Args:
+            s (str | bytes): Document JSON
+            **kwargs: Options transmises à json.loads par le fournisseur par défaut
+
+        Returns:
+            Objet Python correspondant
+        """
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -3,7 +3,8 @@ Module de chargement des modèles d'IA pour l'application RAG API.
 
 Ce module fournit les fonctions nécessaires pour initialiser, exporter et
 récupérer le modèle de vectorisation pour la recherche sémantique. Il utilise
-SentenceTransformer avec un backend OpenVINO pour optimiser les performances.
+SentenceTransformer avec un backend d'inférence optimisé (OpenVINO par défaut,
+ONNX Runtime en option) pour accélérer notamment l'encodage des requêtes.
 """
 import torch
 from sentence_transformers import SentenceTransformer
@@ -18,23 +19,25 @@ load_dotenv()
 # Configuration par défaut
 MODEL_PATH = os.getenv('MODEL_PATH', 'model')
 DEVICE = os.getenv('DEVICE', 'cpu') if os.getenv('DEVICE') else "cuda" if torch.cuda.is_available() else "cpu"
-EXPORTED_MODEL_PATH = os.path.join(MODEL_PATH, "openvino_model")
+# Backend d'inférence : "openvino", "onnx" (ONNX Runtime) ou "torch"
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openvino')
+EXPORTED_MODEL_PATH = os.path.join(MODEL_PATH, f"{EMBEDDING_BACKEND}_model")
 
 # Initialisation du modèle
 model = None
 
 def model_is_exported():
     """
-    Vérifie si le modèle a déjà été exporté en format OpenVINO.
+    Vérifie si le modèle a déjà été exporté pour le backend configuré.
     """
     return os.path.exists(EXPORTED_MODEL_PATH) and os.path.isdir(EXPORTED_MODEL_PATH)
 
 def export_model():
     """
-    Exporte le modèle au format OpenVINO.
+    Exporte le modèle au format du backend configuré (OpenVINO ou ONNX).
     """
-    logging.info("Exportation du modèle au format OpenVINO...")
-    temp_model = SentenceTransformer("intfloat/multilingual-e5-large", backend="openvino", device=DEVICE)
+    logging.info(f"Exportation du modèle au format {EMBEDDING_BACKEND}...")
+    temp_model = SentenceTransformer("intfloat/multilingual-e5-large", backend=EMBEDDING_BACKEND, device=DEVICE)
     os.makedirs(EXPORTED_MODEL_PATH, exist_ok=True)
     temp_model.save_pretrained(EXPORTED_MODEL_PATH)
     logging.info(f"Modèle exporté avec succès dans {EXPORTED_MODEL_PATH}")
@@ -46,12 +49,18 @@ def initialize_model():
     """
     global model
     try:
+        if EMBEDDING_BACKEND == "torch":
+            logging.info(f"Chargement du modèle PyTorch sur {DEVICE}")
+            model = SentenceTransformer("intfloat/multilingual-e5-large", device=DEVICE)
+            return
+
         if not model_is_exported():
-            logging.info("Modèle OpenVINO non trouvé, exportation en cours...")
+            logging.info(f"Modèle {EMBEDDING_BACKEND} non trouvé, exportation en cours...")
             export_model()
         
-        logging.info(f"Chargement du modèle depuis {EXPORTED_MODEL_PATH} sur {DEVICE}")
-        model = SentenceTransformer(EXPORTED_MODEL_PATH, device=DEVICE)  
+        logging.info(f"Chargement du modèle {EMBEDDING_BACKEND} depuis {EXPORTED_MODEL_PATH} sur {DEVICE}")
+        # Le backend doit être repris au chargement, sinon le dossier exporté est relu avec PyTorch
+        model = SentenceTransformer(EXPORTED_MODEL_PATH, backend=EMBEDDING_BACKEND, device=DEVICE)
         logging.info("Modèle chargé avec succès")
     except Exception as e:
         logging.error(f"Erreur lors du chargement du modèle : {e}")
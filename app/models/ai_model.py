@@ -10,6 +10,7 @@ from .together_model import TogetherModel
 from .openai_model import OpenAIModel
 from .groq_model import GroqModel
 from flask import current_app
+from threading import Lock
 import logging
 import importlib
 
@@ -41,11 +42,17 @@ class AIModel:
     
     Cette classe fournit une interface unifiée pour instancier et utiliser différents
     modèles d'IA (OpenAI, Together, Groq, VLLM) de manière cohérente.
+    
+    Les instances sont conservées par configuration (type, clé API, paramètres) : les
+    clients HTTP des SDK et leurs connexions persistantes sont réutilisés d'un appel à
+    l'autre au lieu de rouvrir une connexion TLS pour chaque requête au LLM.
     """
+    _instances = {}
+    _instances_lock = Lock()
     @staticmethod
     def get_model(model_type, api_key=None, **kwargs):
         """
-        Crée et retourne une instance du modèle d'IA spécifié.
+        Crée ou réutilise l'instance du modèle d'IA spécifié pour cette configuration.
 
         Args:
             model_type (str): Type de modèle à instancier ('openai', 'together', 'groq', 'vllm_openai')
@@ -95,7 +102,20 @@ class AIModel:
 
         if model_type in model_classes:
             try:
-                return model_classes[model_type](api_key=api_key, **kwargs)
+                cache_key = (model_type, api_key, tuple(sorted(kwargs.items())))
+                hash(cache_key)
+            except TypeError:
+                cache_key = None
+
+            try:
+                if cache_key is None:
+                    return model_classes[model_type](api_key=api_key, **kwargs)
+                with AIModel._instances_lock:
+                    model = AIModel._instances.get(cache_key)
+                    if model is None:
+                        model = model_classes[model_type](api_key=api_key, **kwargs)
+                        AIModel._instances[cache_key] = model
+                    return model
             except Exception as e:
                 logging.error(f"Erreur lors de la création du modèle {model_type}: {e}")
                 raise
@@ -107,8 +127,8 @@ class AIModel:
         """
         Génère une réponse à partir d'une requête en utilisant le modèle spécifié.
 
-        Cette méthode crée une instance temporaire du modèle spécifié et l'utilise
-        pour générer une réponse à la requête fournie.
+        Cette méthode récupère l'instance partagée du modèle spécifié (voir get_model)
+        et l'utilise pour générer une réponse à la requête fournie.
 
         Args:
             model_type (str): Type de modèle à utiliser ('openai', 'together', 'groq', 'vllm_openai')
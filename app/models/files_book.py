@@ -6,6 +6,49 @@ après son traitement. Il gère le stockage des contenus textuels, des descripti
 embeddings vectoriels et des métadonnées associées, permettant leur utilisation efficace
 dans le pipeline de recherche et d'analyse.
 """
+import base64
+import numpy as np
+from ..utils.text_utils import build_keyword_index, normalize_text, parse_page_num
+
+# Type de stockage des vecteurs de descriptions sur disque (2 octets par dimension)
+VECTORS_STORAGE_DTYPE = np.float16
+
+def encode_vectors_level(vectors):
+    """
+    Encode un niveau de vecteurs en float16 compacté (base64) pour le stockage JSON.
+
+    Args:
+        vectors (list | np.ndarray): Vecteurs du niveau, sous forme de listes ou de matrice (N, D)
+
+    Returns:
+        dict: Dictionnaire {"dtype", "shape", "data"} sérialisable en JSON
+    """
+    matrix = np.asarray(vectors, dtype=VECTORS_STORAGE_DTYPE)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(vectors), -1) if matrix.size else matrix.reshape(0, 0)
+    return {
+        "dtype": np.dtype(VECTORS_STORAGE_DTYPE).name,
+        "shape": list(matrix.shape),
+        "data": base64.b64encode(np.ascontiguousarray(matrix).tobytes()).decode("ascii")
+    }
+
+def decode_vectors_level(level):
+    """
+    Décode un niveau de vecteurs stocké par encode_vectors_level.
+
+    Les anciens fichiers stockant les vecteurs sous forme de listes de flottants
+    sont retournés tels quels pour rester compatibles.
+
+    Args:
+        level (dict | list): Niveau encodé ou liste de vecteurs
+
+    Returns:
+        np.ndarray | list: Matrice (N, D) ou liste de vecteurs d'origine
+    """
+    if not isinstance(level, dict):
+        return level
+    buffer = base64.b64decode(level["data"])
+    return np.frombuffer(buffer, dtype=np.dtype(level["dtype"])).reshape(level["shape"])
 
 class FilesBook:
     """
@@ -20,7 +63,8 @@ class FilesBook:
         summaries (list): Liste des résumés générés pour le livre
         description (str): Description générale du livre
         descriptions (list): Liste hiérarchique des descriptions du livre
-        descriptions_vectorized (list): Liste des vecteurs correspondant aux descriptions
+        descriptions_vectorized (list): Liste des vecteurs correspondant aux descriptions,
+            une matrice float16 (N, D) par niveau une fois relus depuis le disque
     """
 
     def __init__(self, file_name, pages=None, summaries=None, description=None,
@@ -42,6 +86,143 @@ class FilesBook:
         self.description = description
         self.descriptions = descriptions or []
         self.descriptions_vectorized = descriptions_vectorized or []
+        # Matrice float32 normalisée de tous les niveaux, textes normalisés et index de
+        # mots-clés par niveau, calculés à la première requête
+        self._normalized_matrix = None
+        self._level_offsets = None
+        self._normalized_texts = {}
+        self._keyword_indexes = {}
+        self._page_nums = {}
+
+    @property
+    def descriptions_vectorized(self):
+        """Vecteurs des descriptions, un élément (matrice ou liste de vecteurs) par niveau."""
+        return self._descriptions_vectorized
+
+    @descriptions_vectorized.setter
+    def descriptions_vectorized(self, value):
+        # Les vecteurs remplacés invalident la matrice normalisée dérivée (et son .npy relu)
+        self._descriptions_vectorized = value
+        self._normalized_matrix = None
+        self._level_offsets = None
+
+    def get_level_offsets(self):
+        """
+        Retourne les bornes de chaque niveau dans la matrice de get_normalized_matrix.
+
+        Returns:
+            list: Offsets [0, n0, n0 + n1, ...] (longueur : nombre de niveaux + 1)
+        """
+        offsets = [0]
+        for vectors in self.descriptions_vectorized:
+            offsets.append(offsets[-1] + len(vectors))
+        return offsets
+
+    def get_normalized_matrix(self):
+        """
+        Retourne la matrice float32 L2-normalisée de tous les niveaux empilés, et leurs bornes.
+
+        La matrice est calculée une seule fois puis conservée sur l'instance, qui reste
+        elle-même en mémoire dans memory_cache entre les requêtes : le scoring de tous
+        les niveaux d'un livre se réduit à un seul produit matrice-vecteur.
+
+        Returns:
+            tuple: (matrice (N, D) aux lignes de norme 1, offsets des niveaux)
+        """
+        if self._normalized_matrix is None:
+            levels = [np.asarray(vectors, dtype=np.float32) for vectors in self.descriptions_vectorized]
+            dim = next((level.size // len(level) for level in levels if level.size), 0)
+            matrix = np.vstack([level.reshape(len(level), dim) for level in levels]) if levels else \
+                np.zeros((0, 0), dtype=np.float32)
+            if matrix.size:
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-8)
+            self._level_offsets = self.get_level_offsets()
+            self._normalized_matrix = matrix
+        return self._normalized_matrix, self._level_offsets
+
+    def set_normalized_matrix(self, matrix):
+        """
+        Fournit la matrice normalisée déjà calculée (ex: relue par memory-map depuis le disque).
+
+        Args:
+            matrix (np.ndarray): Matrice (N, D) float32 L2-normalisée, niveaux empilés dans l'ordre
+
+        Returns:
+            bool: False si le nombre de lignes ne correspond pas aux vecteurs du livre
+        """
+        offsets = self.get_level_offsets()
+        if matrix.ndim != 2 or matrix.shape[0] != offsets[-1]:
+            return False
+        self._normalized_matrix = matrix
+        self._level_offsets = offsets
+        return True
+
+    def get_normalized_vectors(self, level_idx):
+        """
+        Retourne la matrice float32 L2-normalisée des vecteurs d'un niveau (vue sur get_normalized_matrix).
+
+        Args:
+            level_idx (int): Index du niveau dans descriptions_vectorized
+
+        Returns:
+            np.ndarray: Matrice (N, D) en float32, lignes de norme 1
+        """
+        matrix, offsets = self.get_normalized_matrix()
+        return matrix[offsets[level_idx]:offsets[level_idx + 1]]
+
+    def get_normalized_texts(self, level_idx):
+        """
+        Retourne les textes normalisés (normalize_text) des nœuds d'un niveau et leurs mots.
+
+        Comme get_normalized_matrix, le résultat est calculé une seule fois par livre
+        chargé : le filtrage par mots-clés ne renormalise plus chaque description à chaque requête.
+
+        Args:
+            level_idx (int): Index du niveau dans descriptions
+
+        Returns:
+            list: Couples (texte normalisé, frozenset des mots) alignés sur les nœuds du niveau
+        """
+        texts = self._normalized_texts.get(level_idx)
+        if texts is None:
+            texts = []
+            for node in self.descriptions[level_idx]:
+                normalized = normalize_text(node['text'] if isinstance(node, dict) else node)
+                texts.append((normalized, frozenset(normalized.split())))
+            self._normalized_texts[level_idx] = texts
+        return texts
+
+    def get_page_nums(self, level_idx):
+        """
+        Retourne les numéros de page (parse_page_num) des nœuds d'un niveau, calculés une fois.
+
+        Args:
+            level_idx (int): Index du niveau dans descriptions
+
+        Returns:
+            list: Numéros de page alignés sur les nœuds du niveau (9999 si page_range illisible)
+        """
+        page_nums = self._page_nums.get(level_idx)
+        if page_nums is None:
+            page_nums = [parse_page_num(node.get('page_range')) for node in self.descriptions[level_idx]]
+            self._page_nums[level_idx] = page_nums
+        return page_nums
+
+    def get_keyword_index(self, level_idx):
+        """
+        Retourne l'index de mots-clés (build_keyword_index) des nœuds d'un niveau.
+
+        Args:
+            level_idx (int): Index du niveau dans descriptions
+
+        Returns:
+            dict: Index utilisable par les sélecteurs de compile_keyword_selector
+        """
+        index = self._keyword_indexes.get(level_idx)
+        if index is None:
+            index = build_keyword_index(self.get_normalized_texts(level_idx))
+            self._keyword_indexes[level_idx] = index
+        return index
 
     @staticmethod
     def from_dict(data):
@@ -58,7 +239,8 @@ class FilesBook:
                 - summaries (list): Liste des résumés
                 - description (str): Description générale
                 - descriptions (list): Liste des descriptions
-                - descriptionsVectorized (list): Liste des vecteurs
+                - descriptionsVectorized (list): Liste des vecteurs, encodés par niveau
+                  (voir encode_vectors_level) ou sous forme de listes de flottants
 
         Returns:
             FilesBook: Nouvelle instance créée à partir des données
@@ -69,7 +251,9 @@ class FilesBook:
             summaries=data.get('summaries', []),
             description=data.get('description'),
             descriptions=data.get('descriptions', []),
-            descriptions_vectorized=data.get('descriptionsVectorized', [])
+            descriptions_vectorized=[
+                decode_vectors_level(level) for level in data.get('descriptionsVectorized', [])
+            ]
         )
 
     def to_dict(self):
@@ -86,7 +270,7 @@ class FilesBook:
                 - summaries (list): Liste des résumés
                 - description (str): Description générale
                 - descriptions (list): Liste des descriptions
-                - descriptionsVectorized (list): Liste des vecteurs
+                - descriptionsVectorized (list): Liste des vecteurs, encodés en float16 par niveau
         """
         return {
             'fileName': self.file_name,
@@ -94,5 +278,7 @@ class FilesBook:
             'summaries': self.summaries,
             'description': self.description,
             'descriptions': self.descriptions,
-            'descriptionsVectorized': self.descriptions_vectorized
+            'descriptionsVectorized': [
+                encode_vectors_level(level) for level in self.descriptions_vectorized
+            ]
         }
\ No newline at end of file
@@ -1,4 +1,5 @@
 import logging
+import threading
 from mistralai import Mistral
 
 from app.utils.images_utils import encode_image
@@ -40,4 +41,21 @@ class PixtralModel(BaseLLMModel):
             return response.choices[0].message.content
         except Exception as e:
             logging.error(f"Erreur lors de la génération de la réponse: {e}")
-            return f"Erreur lors de la génération de la réponse: {e}"
\ No newline at end of file
+            return f"Erreur lors de la génération de la réponse: {e}"
+
+
+# Instances partagées par (api_key, model_name) : le client Mistral et son pool de
+# connexions HTTP sont réutilisés d'un PDF à l'autre
+_pixtral_models = {}
+_pixtral_models_lock = threading.Lock()
+
+
+def get_pixtral_model(api_key, model_name="pixtral-large-latest"):
+    """Retourne l'instance PixtralModel partagée pour cette clé API et ce modèle."""
+    key = (api_key, model_name)
+    with _pixtral_models_lock:
+        model = _pixtral_models.get(key)
+        if model is None:
+            model = PixtralModel(api_key=api_key, model_name=model_name)
+            _pixtral_models[key] = model
+        return model
\ No newline at end of file
@@ -10,13 +10,81 @@ from .models.files_book import FilesBook
 from .utils.text_utils import del_pages_number
 from .utils.file_utils import save_processed_data, load_partial_data, save_partial_data, remove_partial_data
 from .utils.ai_utils import correct_ocr_text, generate_overall_description
-from .models.vision_model import PixtralModel
+from .models.vision_model import get_pixtral_model
 
 import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
 import logging
 import time
 import os
+import shelve
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool partagé pour l'encodage des PDF en arrière-plan : borne le nombre d'encodages
+# simultanés (et donc la contention sur le modèle d'embedding) lors des imports en rafale
+ENCODING_EXECUTOR = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix='pdf-encoding')
+
+# Police posée par Tesseract (et les outils qui s'en inspirent) sur la couche texte OCR
+OCR_FONT_NAME = "GlyphLessFont"
+# Mode de rendu PDF 3 : texte invisible, superposé à l'image numérisée
+INVISIBLE_TEXT_RENDER_MODE = 3
+# Part minimale de la surface de la page couverte par une image pour la considérer numérisée
+SCANNED_IMAGE_MIN_COVERAGE = 0.8
+
+def cmyk_pixmap_to_rgb_image(pix):
+    """
+    Convertit un Pixmap CMYK en image PIL RGB à l'aide de NumPy.
+
+    Évite l'allocation d'un second Pixmap via fitz.Pixmap(fitz.csRGB, pix) en appliquant
+    directement la formule RGB = (255 - CMY) * (255 - K) / 255 sur les octets bruts.
+
+    Args:
+        pix (fitz.Pixmap): Pixmap CMYK (avec ou sans canal alpha)
+
+    Returns:
+        PIL.Image.Image: Image RGB convertie
+    """
+    samples = np.frombuffer(pix.samples, dtype=np.uint8)
+    arr = samples.reshape(pix.height, pix.stride)[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    cmy = 255 - arr[..., :3].astype(np.uint16)
+    k = 255 - arr[..., 3:4].astype(np.uint16)
+    rgb = (cmy * k // 255).astype(np.uint8)
+    return Image.fromarray(rgb, mode="RGB")
+
+def is_ocr_page(page):
+    """
+    Détermine si le texte d'une page provient d'une reconnaissance OCR.
+
+    La provenance est lue dans le PDF plutôt que déduite de la forme des mots : les
+    confusions lettre pour lettre (« rn » pour « m », « fl » pour « fi »...) produisent
+    des mots d'apparence normale, alors qu'un texte numérique contient légitimement des
+    mots mêlant lettres et chiffres. Une page est jugée issue d'OCR si sa couche texte
+    utilise la police GlyphLessFont, ou si elle porte du texte invisible (mode de rendu 3)
+    au-dessus d'une image couvrant la quasi-totalité de la page.
+
+    Args:
+        page (fitz.Page): Page du document à analyser
+
+    Returns:
+        bool: True si la page doit passer par la correction OCR, False sinon
+    """
+    if any(OCR_FONT_NAME in font[3] for font in page.get_fonts()):
+        return True
+
+    if not any(span["type"] == INVISIBLE_TEXT_RENDER_MODE for span in page.get_texttrace()):
+        return False
+
+    page_area = abs(page.rect)
+    if not page_area:
+        return False
+    for image in page.get_image_info():
+        image_rect = fitz.Rect(image["bbox"]) & page.rect
+        if abs(image_rect) / page_area >= SCANNED_IMAGE_MIN_COVERAGE:
+            return True
+    return False
 
 def extract_images_from_page(doc, page, temp_dir):
     """
@@ -31,20 +99,35 @@ def extract_images_from_page(doc, page, temp_dir):
         list: Liste des chemins des images extraites
 
     Note:
-        Les images sont converties en RGB si nécessaire et sauvegardées au format PNG.
-        Les ressources sont libérées après traitement.
+        Les flux déjà encodés en JPEG (/DCTDecode) hors CMYK sont écrits tels quels,
+        sans ré-encodage. Les autres images sont converties en RGB si nécessaire et
+        sauvegardées au format PNG. Les ressources sont libérées après traitement.
     """
     image_list = page.get_images(full=True)
     images = []
     for img_index, img in enumerate(image_list):
         xref = img[0]
         try:
+            img_dict = doc.extract_image(xref)
+            if img_dict and img_dict.get("ext") in ("jpeg", "jpg") and img_dict.get("colorspace", 0) < 4:
+                # Flux JPEG d'origine : écriture directe des octets
+                image_path = os.path.join(temp_dir, f"extracted_image_{page.number + 1}_{img_index}.jpg")
+                with open(image_path, "wb") as image_file:
+                    image_file.write(img_dict["image"])
+                images.append(image_path)
+                logging.debug(f"Image JPEG copiée sans ré-encodage à '{image_path}'.")
+                continue
+
             pix = fitz.Pixmap(doc, xref)
-            if pix.n < 5:  # GRAY ou RGB
+            if pix.colorspace and pix.colorspace.n == 4:  # CMYK, conversion vectorisée en RGB
+                image_ext = "png"
+                image_path = os.path.join(temp_dir, f"extracted_image_{page.number + 1}_{img_index}.{image_ext}")
+                cmyk_pixmap_to_rgb_image(pix).save(image_path, "PNG", optimize=False)
+            elif pix.n < 5:  # GRAY ou RGB
                 image_ext = "png"
                 image_path = os.path.join(temp_dir, f"extracted_image_{page.number + 1}_{img_index}.{image_ext}")
                 pix.save(image_path)
-            else:  # CMYK ou autre, convertir en RGB
+            else:  # Autre espace colorimétrique, convertir en RGB
                 pix = fitz.Pixmap(fitz.csRGB, pix)
                 image_ext = "png"
                 image_path = os.path.join(temp_dir, f"extracted_image_{page.number + 1}_{img_index}.{image_ext}")
@@ -71,82 +154,96 @@ def encode_pdf(app, pdf_path, db_path, file_name, begin, end, illustration):
         illustration (bool): Si True, traite également les images du PDF
 
     Note:
-        - Utilise un répertoire temporaire pour le traitement des images
+        - Utilise un répertoire temporaire pour le traitement des images, créé
+          uniquement si une page contient des images
         - Sauvegarde des données partielles pendant le traitement pour permettre la reprise
         - Génère des descriptions textuelles des images si illustration=True
         - Corrige le texte OCR des pages
         - Génère une hiérarchie de descriptions du contenu
     """
-    pixtral_model = PixtralModel(api_key=app.config['MISTRAL_KEY'], model_name="pixtral-large-latest")
+    pixtral_model = get_pixtral_model(app.config['MISTRAL_KEY'], "pixtral-large-latest")
     start_time = time.time()
     logging.info(f"Début du traitement du PDF '{file_name}'.")
     logging.info(f"illustration: {illustration}")
     
-    with tempfile.TemporaryDirectory() as temp_dir:
-        logging.debug(f"Répertoire temporaire créé à '{temp_dir}'.")
-        try:
-            with app.app_context():
-                partial_file = f"{db_path}.partial"
-                partial_data = load_partial_data(partial_file)
-                if partial_data:
-                    logging.info(f"Fichier partiel trouvé pour '{file_name}'. Reprise du traitement.")
-                    book = partial_data
-                else:
-                    logging.info(f"Aucun fichier partiel trouvé pour '{file_name}'. Début d'un nouveau traitement.")
-                    book = FilesBook(file_name=file_name)
-
-                logging.info(f"Ouvrir le PDF '{pdf_path}'.")
-                doc = fitz.open(pdf_path)
-                total_pages = end - begin + 1
-                logging.info(f"Nombre total de pages à traiter: {total_pages} (de {begin} à {end}).")
-
-                corrected_pages = []
+    # Répertoire temporaire créé à la première image extraite seulement
+    temp_dir = None
+    try:
+        with app.app_context():
+            partial_file = f"{db_path}.partial"
+            partial_data = load_partial_data(partial_file)
+            if partial_data:
+                logging.info(f"Fichier partiel trouvé pour '{file_name}'. Reprise du traitement.")
+                book = partial_data
+            else:
+                logging.info(f"Aucun fichier partiel trouvé pour '{file_name}'. Début d'un nouveau traitement.")
+                book = FilesBook(file_name=file_name)
+
+            logging.info(f"Ouvrir le PDF '{pdf_path}'.")
+            doc = fitz.open(pdf_path)
+            total_pages = end - begin + 1
+            logging.info(f"Nombre total de pages à traiter: {total_pages} (de {begin} à {end}).")
+
+            corrected_pages = []
+            # Cache persistant des corrections OCR, conservé entre les exécutions
+            with shelve.open(f"{db_path}.ocr_cache") as ocr_shelf:
                 for page_num in range(begin - 1, end):
                     page = doc[page_num]
                     page_text = page.get_text()
-                    logging.info(f"Correction OCR de la page {page_num + 1}")
+                    if is_ocr_page(page):
+                        logging.info(f"Correction OCR de la page {page_num + 1}")
+                        corrected_text = correct_ocr_text(page_text, app, persistent_cache=ocr_shelf)
+                    else:
+                        logging.info(f"Page {page_num + 1} sans couche texte OCR, correction ignorée")
+                        corrected_text = page_text
 
-                    corrected_text = correct_ocr_text(page_text, app)
-
-                    if illustration:
+                    if illustration and page.get_images():
+                        if temp_dir is None:
+                            temp_dir = tempfile.mkdtemp()
+                            logging.debug(f"Répertoire temporaire créé à '{temp_dir}'.")
                         images = extract_images_from_page(doc, page, temp_dir)
                         if images:
+                            # Descriptions accumulées puis jointes une seule fois
+                            text_parts = [corrected_text]
                             for image_path in images:
                                 try:
                                     logging.debug(f"Traitement de l'image '{image_path}'.")
                                     image_description = pixtral_model.generate_response(image_path, corrected_text)
-                                    corrected_text += f"\n\n### Description des illustrations\n{image_description}"
+                                    text_parts.append(f"\n\n### Description des illustrations\n{image_description}")
                                 except Exception as e:
                                     logging.error(f"Erreur lors de la génération de la description de l'image '{image_path}': {e}")
+                            corrected_text = "".join(text_parts)
 
                     corrected_pages.append({
                         "pageNumber": page_num + 1,
                         "text": corrected_text
                     })
 
-                if not book.descriptions:
-                    logging.info("Génération de l'arbre de descriptions...")
-                    book.description, book.descriptions, book.descriptions_vectorized = generate_overall_description(
-                        corrected_pages,
-                        app.model,
-                        partial_file=partial_file,
-                        book=book
-                    )
-                    logging.info("Arbre de descriptions généré avec succès.")
+            if not book.descriptions:
+                logging.info("Génération de l'arbre de descriptions...")
+                book.description, book.descriptions, book.descriptions_vectorized = generate_overall_description(
+                    corrected_pages,
+                    app.model,
+                    partial_file=partial_file,
+                    book=book
+                )
+                logging.info("Arbre de descriptions généré avec succès.")
 
-                save_processed_data(db_path, book)
-                logging.info(f"Fichier PDF '{file_name}' traité avec succès.")
+            save_processed_data(db_path, book)
+            logging.info(f"Fichier PDF '{file_name}' traité avec succès.")
 
-                remove_partial_data(partial_file)
-                logging.debug(f"Fichier partiel '{partial_file}' supprimé.")
+            remove_partial_data(partial_file)
+            logging.debug(f"Fichier partiel '{partial_file}' supprimé.")
 
-        except Exception as e:
-            logging.error(f"Erreur lors du traitement du PDF '{file_name}': {e}")
-            logging.exception("Détails de l'erreur :")
-            raise
-        finally:
-            elapsed_time = time.time() - start_time
-            logging.info(f"Temps total de traitement pour '{file_name}': {elapsed_time:.2f} secondes.")
+    except Exception as e:
+        logging.error(f"Erreur lors du traitement du PDF '{file_name}': {e}")
+        logging.exception("Détails de l'erreur :")
+        raise
+    finally:
+        elapsed_time = time.time() - start_time
+        logging.info(f"Temps total de traitement pour '{file_name}': {elapsed_time:.2f} secondes.")
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
 
 def process_query_simple(app, question, files, max_pages=20):
@@ -281,8 +378,9 @@ def get_relevant_sources_simple(app, query, files=None, k=5, max_pages=30, auto_
         else:
             mode = "manual"
             # Mode manuel : utiliser les fichiers fournis
+            books_by_filename = book_service.get_books_by_filenames(files)
             for file_path in files:
-                book_data = book_service.get_book_by_filename(file_path)
+                book_data = books_by_filename.get(file_path)
                 if book_data:
                     selected_books.append({
                         'title': book_data.get('title', ''),
@@ -316,7 +414,8 @@ def get_relevant_sources_simple(app, query, files=None, k=5, max_pages=30, auto_
         # Chargement et scoring des fichiers
         leaf_matches, tree_matches, processed_file_books = load_and_score_files(
             app, files, vector_to_compare, most_words, 
-            lambda msg: logging.debug(f"File processing: {msg}")
+            lambda msg: logging.debug(f"File processing: {msg}"),
+            top_k=int(max_pages)
         )
         
         # Filtrage initial par score et page
@@ -325,7 +424,9 @@ def get_relevant_sources_simple(app, query, files=None, k=5, max_pages=30, auto_
         # Filtrage LLM pour la pertinence
         all_matches = llm_filter_matches(
             initial_matches, query, api_key, model_type_for_filter,
-            lambda msg: logging.debug(f"LLM filtering: {msg}")
+            lambda msg: logging.debug(f"LLM filtering: {msg}"),
+            keep_above=app['config'].get('LLM_FILTER_KEEP_ABOVE'),
+            drop_below=app['config'].get('LLM_FILTER_DROP_BELOW')
         )
         
         # Limiter aux k meilleures sources
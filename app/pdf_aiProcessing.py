@@ -8,6 +8,7 @@ des réponses basées sur les contenus extraits des documents PDF.
 """
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from .utils.pdfQuery_utils import (
     extract_keywords,
@@ -16,7 +17,7 @@ from .utils.pdfQuery_utils import (
     load_and_score_files,
     filter_matches_by_score_and_page,
     llm_filter_matches,
-    prepare_batches_for_llm,
+    iter_batches_for_llm,
     generate_partial_responses,
     merge_all_responses,
     save_response_to_db
@@ -24,6 +25,7 @@ from .utils.pdfQuery_utils import (
 from .services.queryData_service import QueryDataService
 from .services.book_service import BookService
 from .utils.query_processor import QueryProcessor
+from .utils.model_utils import with_app_context
 from app.services import book_service
 
 # Initialisation des services
@@ -37,7 +39,6 @@ def process_query(app, query, files, new_generate, additional_instructions="", m
 
     try:
         partial_responses = []
-        batches_to_process = []
 
         send_progress("Démarrage du traitement...")
         logging.info("=" * 50)
@@ -57,11 +58,18 @@ def process_query(app, query, files, new_generate, additional_instructions="", m
         model_type_for_response = app['config']['AI_MODEL_TYPE_FOR_RESPONSE']
         model_type_for_filter = app['config']['AI_MODEL_TYPE']
         
+        # L'extraction des mots-clés ne dépend que de la requête brute : elle est lancée
+        # en tâche de fond pour se superposer à la clarification et à la vectorisation
+        keywords_executor = ThreadPoolExecutor(max_workers=1)
+        keywords_future = keywords_executor.submit(extract_keywords, query, send_progress)
+        keywords_executor.shutdown(wait=False)
+
         send_progress("Clarification de la question")
         file_books = []
+        # Récupère en une requête les livres associés aux fichiers PDF
+        books_by_filename = book_service.get_books_by_filenames(files)
         for f in files:
-            # Récupère le livre par son nom de fichier PDF
-            book_data = book_service.get_book_by_filename(f)
+            book_data = books_by_filename.get(f)
             if book_data and 'description' in book_data and book_data['description']:
                 file_books.append({
                     "filename": f,
@@ -79,26 +87,35 @@ def process_query(app, query, files, new_generate, additional_instructions="", m
             # Trouver des sous-questions
             subqueries = QueryProcessor.generate_subquestions(finalquery, file_books, api_key, model_type_for_filter)
             logging.info("Sous-questions trouvées:"+str(subqueries))
-            # Traitement des sous-questions
-            # Accumules les sous-reponses dans accumulated_subqueries
-            for subquery in subqueries:
-                subresponse = QueryProcessor.process_subquery(app, subquery, files, new_generate, additional_instructions, max_page, progress_callback)
-                accumulated_subqueries += subresponse
+            # Traitement des sous-questions en parallèle (indépendantes par construction)
+            # Accumules les sous-reponses dans accumulated_subqueries, dans l'ordre des sous-questions
+            if subqueries:
+                with ThreadPoolExecutor(max_workers=min(8, len(subqueries))) as executor:
+                    # Chaque sous-question appelle le LLM : le contexte Flask de l'appelant est propagé
+                    subresponses = list(executor.map(
+                        with_app_context(lambda subquery: QueryProcessor.process_subquery(app, subquery, files, new_generate, additional_instructions, max_page, progress_callback)),
+                        subqueries
+                    ))
+                accumulated_subqueries = "".join(subresponses)
             logging.info("Sous-reponses accumulées:"+accumulated_subqueries)
         # Suite du pipeline standard (mots clés, vectorisation, cache, etc.)
-        most_words = extract_keywords(query, send_progress)
         vector_to_compare = vectorize_user_query(finalquery if not mode_infinity else query, model, send_progress)
+        most_words = keywords_future.result()
 
         cached = check_cache(finalquery, most_words, vector_to_compare, query_service, device, new_generate, send_progress)
         if cached:
             return cached
 
-        leaf_matches, tree_matches, processed_file_books = load_and_score_files(app, files, vector_to_compare, most_words, send_progress)
+        leaf_matches, tree_matches, processed_file_books = load_and_score_files(app, files, vector_to_compare, most_words, send_progress, top_k=int(max_page))
 
         send_progress("Filtrage initial des résultats...")
         initial_matches = filter_matches_by_score_and_page(leaf_matches, tree_matches, max_page)
 
-        all_matches = llm_filter_matches(initial_matches, finalquery, api_key, model_type_for_filter, send_progress)
+        all_matches = llm_filter_matches(
+            initial_matches, finalquery, api_key, model_type_for_filter, send_progress,
+            keep_above=app['config'].get('LLM_FILTER_KEEP_ABOVE'),
+            drop_below=app['config'].get('LLM_FILTER_DROP_BELOW')
+        )
 
         if not all_matches:
             send_progress("Aucune correspondance pertinente trouvée.")
@@ -111,7 +128,7 @@ def process_query(app, query, files, new_generate, additional_instructions="", m
                 }
             }
 
-        batches_to_process = prepare_batches_for_llm(finalquery, all_matches, processed_file_books, send_progress)
+        batches_to_process = iter_batches_for_llm(finalquery, all_matches, processed_file_books, send_progress)
         partial_responses = generate_partial_responses(batches_to_process, api_key, model_type_for_response, send_progress=send_progress)
         final_response = merge_all_responses(app, partial_responses, finalquery, additional_instructions, send_progress=send_progress, add_section=add_section)
         if mode_infinity and accumulated_subqueries:
@@ -130,7 +147,6 @@ def process_query(app, query, files, new_generate, additional_instructions="", m
         logging.info("=" * 50)
         logging.info("END OF QUERY PROCESSING")
         logging.info(f"Total execution time: {execution_time:.2f} seconds")
-        logging.info(f"Number of batches processed: {len(batches_to_process)}")
         logging.info(f"Number of partial responses: {len(partial_responses)}")
         logging.info("=" * 50)
 
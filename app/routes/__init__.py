@@ -20,6 +20,10 @@ def init_routes(app):
         app: L'instance de l'application Flask
     """
 
+    # '/book' et '/book/' désignent la même route : pas de redirection 308 (ni de second
+    # aller-retour du client) quand la barre finale diffère. À fixer avant l'ajout des règles.
+    app.url_map.strict_slashes = False
+
     # Enregistrer les blueprints essentiels
     app.register_blueprint(book_bp, url_prefix='/book')
     app.register_blueprint(pdf_bp, url_prefix='/pdf')
@@ -1,14 +1,13 @@
 import logging
 import os
 import time
-from threading import Thread
 from flask import Blueprint, jsonify, request, current_app
-from app.pdf_aiEncode import encode_pdf
+from app.pdf_aiEncode import ENCODING_EXECUTOR, encode_pdf
 from app.services import BookService
 from app.utils.ai_utils import reduceTextForDescriptions
-from app.utils.file_utils import load_processed_data, save_processed_data
-from app.utils.images_utils import convert_pdf_page_to_image
-from app.utils.vector_utils import compare_query_to_descriptions, serialize_tensor
+from app.utils.file_utils import get_processed_data_etag, load_processed_data, save_uploaded_file, save_uploaded_image
+from app.utils.images_utils import convert_pdf_page_to_image, save_image
+from app.utils.vector_utils import compare_query_to_descriptions, ensure_description_vectors
 from app.dto.book_dto import (
     BookCreationRequestDTO, BookUpdateRequestDTO, BookResponseDTO, 
     BookListResponseDTO, GenerateCoverRequestDTO, DescriptionGenerationRequestDTO
@@ -48,14 +47,17 @@ def create_book_route():
         # Ajout de propriétés supplémentaires spécifiques à notre implémentation
         form_data['proprietary'] = 'system'
 
+        # Paramètres d'encodage, lus une seule fois pour la base et le traitement en arrière-plan
+        begin = int(form_data.get('begin', 0))
+        end = int(form_data.get('end', 0))
+        illustration_value = form_data.get('illustration', 'false').lower() == 'true'
+
         logging.info(f"Données reçues pour la création du livre : {form_data}")
 
         # Gestion de l'image de couverture
         if 'cover_image' in request.files:
             cover_image = request.files['cover_image']
-            filename = cover_image.filename
-            cover_image_path = os.path.join(current_app.config['IMAGE_FOLDER'], filename)
-            cover_image.save(cover_image_path)
+            filename = save_uploaded_image(cover_image, current_app.config['IMAGE_FOLDER'])
             form_data['cover_image'] = filename
             book_creation_request.cover_image = filename
 
@@ -74,10 +76,9 @@ def create_book_route():
             os.makedirs(pdf_directory)
 
         pdf_path = os.path.join(pdf_directory, pdf_filename)
-        pdf_file.save(pdf_path)
+        save_uploaded_file(pdf_file, pdf_path)
 
         db_path = os.path.join(current_app.config['FOLDER_PATH'], directory, pdf_filename)
-        illustration_value = form_data.get('illustration', 'false').lower() == 'true'
         
         # Création du livre dans la base de données
         book_data = {
@@ -90,9 +91,9 @@ def create_book_route():
             'category': form_data.get('category'),
             'subcategory': form_data.get('subcategory'),
             'directory': directory,
-            'begin': int(form_data.get('begin', 0)),
+            'begin': begin,
             'illustration': illustration_value,
-            'end': int(form_data.get('end', 0)),
+            'end': end,
             'pdf_path': os.path.join(directory, pdf_filename),
             'db_path': os.path.join(directory, pdf_filename + ".db"),
             'public': book_creation_request.public,
@@ -135,16 +136,16 @@ def create_book_route():
                 logging.error(f"Erreur lors de la génération de l'embedding : {e}")
 
         # Lancement du traitement PDF en arrière-plan
-        thread = Thread(target=encode_pdf, args=(
+        ENCODING_EXECUTOR.submit(
+            encode_pdf,
             current_app._get_current_object(),
             pdf_path,
             db_path,
             pdf_filename,
-            int(form_data.get('begin', 0)),
-            int(form_data.get('end', 0)),
+            begin,
+            end,
             illustration_value
-        ))
-        thread.start()
+        )
 
         # Création de la réponse
         response = BookResponseDTO(
@@ -182,8 +183,8 @@ def get_books_route():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
         
-        # Récupération des livres
-        books_data = book_service.get_all_books()
+        # Récupération des livres, sans les vecteurs de description inutiles au listage
+        books_data = book_service.get_all_books(include_embeddings=False)
         logging.info(f"Found {len(books_data)} books in database")
         
         # Calculer le nombre total de livres
@@ -223,7 +224,10 @@ def get_books_route():
             per_page=per_page
         )
         
-        return jsonify(response.to_dict()), 200
+        # ETag sur le contenu : un client à jour reçoit un 304 sans corps
+        json_response = jsonify(response.to_dict())
+        json_response.add_etag()
+        return json_response.make_conditional(request)
     except Exception as e:
         logging.error(f"Error getting books: {e}")
         return jsonify({"error": str(e)}), 500
@@ -310,9 +314,7 @@ def update_book_route(book_id):
         # Gestion de l'image de couverture
         if 'cover_image' in request.files:
             cover_image = request.files['cover_image']
-            filename = cover_image.filename
-            cover_image_path = os.path.join(current_app.config['IMAGE_FOLDER'], filename)
-            cover_image.save(cover_image_path)
+            filename = save_uploaded_image(cover_image, current_app.config['IMAGE_FOLDER'])
             book_update_request.cover_image = filename
         
         # Conversion du DTO en dictionnaire pour la mise à jour
@@ -446,7 +448,7 @@ def generate_book_cover():
             
         # Sauvegarder l'image
         image_path = os.path.join(current_app.config['IMAGE_FOLDER'], image_filename)
-        img.save(image_path, format='WEBP', quality=85)
+        save_image(img, image_path, format='WEBP', quality=85)
         
         # Mettre à jour le livre dans la base de données
         update_result = book_service.update_book(
@@ -593,6 +595,14 @@ def get_descriptions_by_title_route(title):
         if not db_path:
             return jsonify({"error": "Chemin du fichier non trouvé"}), 404
 
+        # Un client dont la copie correspond au .db actuel reçoit un 304, sans que les
+        # descriptions soient chargées ni sérialisées
+        etag = get_processed_data_etag(current_app.config, db_path)
+        if etag and request.if_none_match.contains_weak(etag):
+            not_modified = current_app.response_class(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
         files_book = load_processed_data(current_app, db_path)
         if not files_book:
             return jsonify({"error": "Impossible de charger les données traitées"}), 500
@@ -600,7 +610,12 @@ def get_descriptions_by_title_route(title):
         if not files_book.descriptions:
             return jsonify({"error": "Descriptions non trouvées"}), 404
 
-        return jsonify({"descriptions": files_book.descriptions}), 200
+        response = jsonify({"descriptions": files_book.descriptions})
+        if etag:
+            # Revalidation systématique : les descriptions changent à chaque réencodage
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+        return response, 200
 
     except Exception as e:
         logging.error(f"Erreur lors de la récupération des descriptions : {e}")
@@ -644,23 +659,12 @@ def get_similarity_by_title_route(title):
         if not files_book.descriptions:
             return jsonify({"error": "Descriptions not found"}), 404
 
-        if not files_book.descriptions_vectorized:
-            logging.info("Computing description vectors...")
-            descriptions_vectorized = []
-            for level in files_book.descriptions:
-                level_vectors = []
-                for desc in level:
-                    embedding = current_app.model.encode(desc, convert_to_tensor=True, normalize_embeddings=True)
-                    level_vectors.append(serialize_tensor(embedding))
-                descriptions_vectorized.append(level_vectors)
-            files_book.descriptions_vectorized = descriptions_vectorized
-            save_processed_data(db_path, files_book)
-            logging.info("Description vectors computed and saved")
+        ensure_description_vectors(files_book, db_path, current_app.model)
 
         similarities = compare_query_to_descriptions(
             query,
             files_book.descriptions,
-            files_book.descriptions_vectorized,
+            files_book.get_normalized_matrix()[0],
             current_app.model,
             current_app.config['device']
         )
@@ -9,17 +9,21 @@ traitements longs.
 """
 
 import json
-from flask import Blueprint, Response, jsonify, request, current_app, send_from_directory, abort, stream_with_context
+from flask import Blueprint, Response, jsonify, request, current_app, send_from_directory, abort, stream_with_context, make_response
 import logging
+import mimetypes
 import os
 from threading import Thread
 from queue import Queue
+from urllib.parse import quote
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
 from app.utils.images_utils import convert_pdf_page_to_image
-from app.utils.vector_utils import compare_query_to_descriptions, serialize_tensor
-from app.utils.file_utils import load_processed_data, save_processed_data
+from app.utils.vector_utils import compare_query_to_descriptions, ensure_description_vectors
+from app.utils.file_utils import get_processed_data_etag, load_processed_data, save_uploaded_file, save_uploaded_image
 from app.utils.ai_utils import reduceTextForDescriptions
 from app.pdf_aiProcessing import process_query
-from app.pdf_aiEncode import encode_pdf
+from app.pdf_aiEncode import ENCODING_EXECUTOR, encode_pdf
 from app.services import BookService
 from app.config import extract_config
 
@@ -79,6 +83,42 @@ def process_sse():
 
     return Response(stream_with_context(event_stream()), mimetype='text/event-stream')
 
+def send_static_file(directory, relative_path, accel_prefix=None, max_age=None):
+    """
+    Sert un fichier d'un répertoire, directement ou via le reverse proxy.
+
+    Si accel_prefix est défini, la réponse est vide et porte un en-tête X-Accel-Redirect
+    vers la location interne correspondante : nginx envoie alors le fichier lui-même
+    et le worker Python est libéré immédiatement. Sinon, send_from_directory est utilisé.
+
+    Args:
+        directory (str): Répertoire racine des fichiers
+        relative_path (str): Chemin du fichier relatif à ce répertoire
+        accel_prefix (str, optional): Préfixe de la location interne nginx
+        max_age (int, optional): Durée de mise en cache navigateur en secondes (Cache-Control public)
+
+    Returns:
+        Response: Réponse Flask servant le fichier
+
+    Raises:
+        NotFound: Si le fichier n'existe pas ou sort du répertoire
+    """
+    if not accel_prefix:
+        return send_from_directory(directory, relative_path, max_age=max_age)
+
+    path = safe_join(directory, relative_path)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    response = make_response('')
+    response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(relative_path.replace(os.sep, '/'))
+    response.headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if max_age:
+        # Conservé par nginx sur la réponse finale
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
 @pdf_bp.route('/images/<filename>')
 def serve_image(filename):
     """
@@ -88,10 +128,17 @@ def serve_image(filename):
         filename (str): Nom du fichier image
         
     Returns:
-        File: Fichier image demandé
+        File: Fichier image demandé (ETag et Last-Modified pour les requêtes conditionnelles,
+        Cache-Control public de durée IMAGE_CACHE_MAX_AGE)
     """
-    logging.info(f"Serving image: {filename}")
-    return send_from_directory(current_app.config['IMAGE_FOLDER'], filename)
+    logging.debug(f"Serving image: {filename}")
+    config = current_app.config
+    return send_static_file(
+        config['IMAGE_FOLDER'],
+        filename,
+        config.get('X_ACCEL_IMAGE_PREFIX'),
+        max_age=config.get('IMAGE_CACHE_MAX_AGE')
+    )
 
 @pdf_bp.route('/<path:subpath>/<filename>')
 def serve_pdf(subpath, filename):
@@ -106,19 +153,28 @@ def serve_pdf(subpath, filename):
         File: Fichier PDF demandé
         404: Si le fichier n'existe pas
     """
-    # Essayer d'abord le chemin direct
-    full_path = os.path.join(current_app.config['PDF_FOLDER'], subpath, filename)
-    if os.path.exists(full_path) and os.path.commonpath([full_path, current_app.config['PDF_FOLDER']]) == current_app.config['PDF_FOLDER']:
-        return send_from_directory(current_app.config['PDF_FOLDER'], os.path.join(subpath, filename))
-    
+    # Configuration lue une fois par requête (current_app est un proxy)
+    config = current_app.config
+    pdf_folder = config['PDF_FOLDER']
+    accel_prefix = config.get('X_ACCEL_PDF_PREFIX')
+
+    # Essayer d'abord le chemin direct : un seul realpath comparé au préfixe précalculé,
+    # l'absence du fichier étant signalée par send_static_file (NotFound)
+    full_path = os.path.join(pdf_folder, subpath, filename)
+    if os.path.realpath(full_path).startswith(config['PDF_ROOT_PREFIX']):
+        try:
+            return send_static_file(pdf_folder, os.path.join(subpath, filename), accel_prefix)
+        except NotFound:
+            pass
+
     # Si non trouvé, rechercher dans tous les sous-répertoires
-    for root, dirs, files in os.walk(current_app.config['PDF_FOLDER']):
+    for root, dirs, files in os.walk(pdf_folder):
         if filename in files:
-            relative_path = os.path.relpath(root, current_app.config['PDF_FOLDER'])
+            relative_path = os.path.relpath(root, pdf_folder)
             file_path = os.path.join(relative_path, filename)
             if relative_path == '.':
                 file_path = filename
-            return send_from_directory(current_app.config['PDF_FOLDER'], file_path)
+            return send_static_file(pdf_folder, file_path, accel_prefix)
     
     abort(404)
 
@@ -145,6 +201,14 @@ def get_descriptions_by_title(title):
         if not db_path:
             return jsonify({"error": "Chemin du fichier non trouvé"}), 404
 
+        # Un client dont la copie correspond au .db actuel reçoit un 304, sans que les
+        # descriptions soient chargées ni sérialisées
+        etag = get_processed_data_etag(current_app.config, db_path)
+        if etag and request.if_none_match.contains_weak(etag):
+            not_modified = current_app.response_class(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
         files_book = load_processed_data(current_app, db_path)
         if not files_book:
             return jsonify({"error": "Impossible de charger les données traitées"}), 500
@@ -152,7 +216,12 @@ def get_descriptions_by_title(title):
         if not files_book.descriptions:
             return jsonify({"error": "Descriptions non trouvées"}), 404
 
-        return jsonify({"descriptions": files_book.descriptions}), 200
+        response = jsonify({"descriptions": files_book.descriptions})
+        if etag:
+            # Revalidation systématique : les descriptions changent à chaque réencodage
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+        return response, 200
 
     except Exception as e:
         logging.error(f"Erreur lors de la récupération des descriptions : {e}")
@@ -196,23 +265,12 @@ def get_similarity_by_title(title):
         if not files_book.descriptions:
             return jsonify({"error": "Descriptions not found"}), 404
 
-        if not files_book.descriptions_vectorized:
-            logging.info("Computing description vectors...")
-            descriptions_vectorized = []
-            for level in files_book.descriptions:
-                level_vectors = []
-                for desc in level:
-                    embedding = current_app.model.encode(desc, convert_to_tensor=True, normalize_embeddings=True)
-                    level_vectors.append(serialize_tensor(embedding))
-                descriptions_vectorized.append(level_vectors)
-            files_book.descriptions_vectorized = descriptions_vectorized
-            save_processed_data(db_path, files_book)
-            logging.info("Description vectors computed and saved")
+        ensure_description_vectors(files_book, db_path, current_app.model)
 
         similarities = compare_query_to_descriptions(
             query,
             files_book.descriptions,
-            files_book.descriptions_vectorized,
+            files_book.get_normalized_matrix()[0],
             current_app.model,
             current_app.config['device']
         )
@@ -300,7 +358,8 @@ def batch_process_pdfs():
             if not all([pdf_path, db_path, filename]):
                 continue
 
-            thread = Thread(target=encode_pdf, args=(
+            ENCODING_EXECUTOR.submit(
+                encode_pdf,
                 current_app._get_current_object(),
                 pdf_path,
                 db_path,
@@ -308,8 +367,7 @@ def batch_process_pdfs():
                 begin,
                 end,
                 illustration
-            ))
-            thread.start()
+            )
 
         return jsonify({
             "message": "Batch processing started",
@@ -372,14 +430,17 @@ def create_book_route():
         data = request.form.to_dict()
         data['proprietary'] = 'system'
 
+        # Paramètres d'encodage, lus une seule fois pour la base et le traitement en arrière-plan
+        begin = int(data.get('begin', 0))
+        end = int(data.get('end', 0))
+        illustration_value = data.get('illustration', 'false').lower() == 'true'
+
         logging.info(f"Données reçues pour la création du livre : {data}")
 
         # Gestion de l'image de couverture
         if 'cover_image' in request.files:
             cover_image = request.files['cover_image']
-            filename = cover_image.filename
-            cover_image_path = os.path.join(current_app.config['IMAGE_FOLDER'], filename)
-            cover_image.save(cover_image_path)
+            filename = save_uploaded_image(cover_image, current_app.config['IMAGE_FOLDER'])
             data['cover_image'] = filename
 
         # Gestion du fichier PDF
@@ -396,10 +457,9 @@ def create_book_route():
             os.makedirs(pdf_directory)
 
         pdf_path = os.path.join(pdf_directory, pdf_filename)
-        pdf_file.save(pdf_path)
+        save_uploaded_file(pdf_file, pdf_path)
 
         db_path = os.path.join(current_app.config['FOLDER_PATH'], directory, pdf_filename)
-        illustration_value = data.get('illustration', 'false').lower() == 'true'
         # Création du livre dans la base de données
         book_id = book_service.create_book({
             'title': data.get('title'),
@@ -410,9 +470,9 @@ def create_book_route():
             'category': data.get('category'),
             'subcategory': data.get('subcategory'),
             'directory': directory,
-            'begin': int(data.get('begin', 0)),
+            'begin': begin,
             'illustration': illustration_value,
-            'end': int(data.get('end', 0)),
+            'end': end,
             'pdf_path': os.path.join(directory, pdf_filename),
             'db_path': os.path.join(directory, pdf_filename + ".db"),
             'metadata': data.get('metadata', {})
@@ -422,16 +482,16 @@ def create_book_route():
             return jsonify({"error": "Failed to create book"}), 500
 
         # Lancement du traitement PDF en arrière-plan
-        thread = Thread(target=encode_pdf, args=(
+        ENCODING_EXECUTOR.submit(
+            encode_pdf,
             current_app._get_current_object(),
             pdf_path,
             db_path,
             pdf_filename,
-            int(data.get('begin', 0)),
-            int(data.get('end', 0)),
+            begin,
+            end,
             illustration_value
-        ))
-        thread.start()
+        )
 
         return jsonify({
             "message": "Book created successfully",
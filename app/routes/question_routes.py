@@ -224,15 +224,17 @@ def generate_questions():
     
     # Mélanger aléatoirement les pages pour éviter un ordre biaisé et accumuler jusqu'à la limite de tokens
     random.shuffle(context_texts)
-    context_combined = ""
+    context_parts = []
+    context_tokens = 0
     for text in context_texts:
-        # On ajoute un séparateur pour distinguer les pages (par exemple, deux sauts de ligne)
-        new_context = context_combined + "\n\n" + text if context_combined else text
-        if estimate_tokens(new_context) <= MAX_CONTEXT_TOKENS:
-            context_combined = new_context
-        else:
-            # Si l'ajout de ce texte dépasse la limite, on passe au suivant
-            continue
+        # Le séparateur entre pages (deux sauts de ligne) n'ajoute aucun mot : l'estimation
+        # du contexte cumulé est la somme des estimations de chaque page
+        text_tokens = estimate_tokens(text)
+        if context_tokens + text_tokens <= MAX_CONTEXT_TOKENS:
+            context_parts.append(text)
+            context_tokens += text_tokens
+        # Sinon, l'ajout de ce texte dépasse la limite, on passe au suivant
+    context_combined = "\n\n".join(context_parts)
     
     if not context_combined:
         return jsonify({"error": "Le contexte est vide après application de la limite de tokens."}), 400
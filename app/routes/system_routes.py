@@ -8,7 +8,7 @@ système utiles pour l'administration et le monitoring.
 
 from flask import Blueprint, jsonify
 from ..utils.vector_utils import get_cache_stats
-from ..utils.cache_utils import memory_cache
+from ..utils.cache_utils import memory_cache, ocr_cache, query_vector_cache
 
 system_bp = Blueprint('system', __name__)
 
@@ -28,7 +28,9 @@ def get_cache_statistics():
     
     return jsonify({
         "vector_cache": vector_cache_stats,
-        "memory_cache": memory_cache_stats
+        "memory_cache": memory_cache_stats,
+        "ocr_cache": ocr_cache.get_stats(),
+        "query_vector_cache": query_vector_cache.get_stats()
     })
 
 @system_bp.route('/status', methods=['GET'])
@@ -4,8 +4,15 @@ from ..utils.book_embedding_utils import (
     generate_description_embedding, should_update_embedding, 
     search_books_by_embedding, calculate_embedding_stats
 )
+from ..utils.cache_utils import book_title_cache, book_list_cache
 from bson import ObjectId
 import logging
+import time
+
+# Durée de validité (secondes) des livres mis en cache (par titre et liste complète) :
+# borne le décalage avec les écritures faites par d'autres processus, les écritures
+# locales vidant les caches
+BOOK_CACHE_TTL = 30
 
 __all__ = ['BookService']
 
@@ -54,6 +61,7 @@ class BookService:
             db_book = DBBook(**book_data)
             result = self.books_collection.insert_one(db_book.to_dict())
             book_id = str(result.inserted_id)
+            self._invalidate_caches()
             logging.info(f"Livre créé avec l'ID : {book_id}")
             
             # Générer l'embedding de la description si présente
@@ -110,16 +118,37 @@ class BookService:
             logging.error(f"Erreur lors de la récupération du livre par ID : {e}")
             return None
 
-    def get_all_books(self):
+    def _invalidate_caches(self):
+        """
+        Vide les caches de livres après une écriture dans la collection.
+        """
+        book_title_cache.clear()
+        book_list_cache.clear()
+
+    def get_all_books(self, include_embeddings=True):
         """
         Récupère tous les livres de la base de données.
-                
+
+        La liste est conservée BOOK_CACHE_TTL secondes dans book_list_cache : la
+        recherche par description et le listage paginé ne relisent pas toute la collection
+        à chaque requête. Les dictionnaires de livres sont partagés et ne doivent pas
+        être modifiés par l'appelant.
+
+        Args:
+            include_embeddings (bool): Si False, les vecteurs description_embedding ne sont
+                pas transférés depuis MongoDB (listage sans recherche sémantique)
+
         Returns:
             list: Liste de tous les livres
         """
         try:
+            cached = book_list_cache.get(include_embeddings)
+            if cached and cached[0] > time.monotonic():
+                return list(cached[1])
+
             books = []
-            cursor = self.books_collection.find()
+            projection = None if include_embeddings else {"description_embedding": 0}
+            cursor = self.books_collection.find({}, projection)
 
             for book_data in cursor:
                 book_data["_id"] = str(book_data["_id"])
@@ -129,7 +158,8 @@ class BookService:
                 if 'subcategory' not in book_data:
                     book_data['subcategory'] = None
                 books.append(DBBook.from_dict(book_data).to_dict())
-            return books
+            book_list_cache.put(include_embeddings, (time.monotonic() + BOOK_CACHE_TTL, books))
+            return list(books)
         except Exception as e:
             logging.error(f"Erreur lors de la récupération des livres : {e}")
             return []
@@ -161,6 +191,7 @@ class BookService:
                 {"_id": ObjectId(book_id)},
                 {"$set": update_dict}
             )
+            self._invalidate_caches()
             
             # Mettre à jour l'embedding si la description a changé
             if 'description' in update_data:
@@ -195,6 +226,7 @@ class BookService:
         """
         try:
             result = self.books_collection.delete_one({"_id": ObjectId(book_id)})
+            self._invalidate_caches()
             return result.deleted_count > 0
         except Exception as e:
             logging.error(f"Erreur lors de la suppression du livre : {e}")
@@ -225,6 +257,32 @@ class BookService:
             logging.error(f"Erreur lors de la récupération du livre par filename : {e}")
             return None
 
+    def get_books_by_filenames(self, filenames):
+        """
+        Récupère en une seule requête les livres associés à plusieurs fichiers PDF.
+        
+        Args:
+            filenames (list): Noms des fichiers PDF des livres
+            
+        Returns:
+            dict: Données des livres indexées par nom de fichier PDF (fichiers absents omis)
+        """
+        try:
+            books = {}
+            cursor = self.books_collection.find({"pdf_path": {"$in": list(filenames)}})
+            for book_data in cursor:
+                book_data["_id"] = str(book_data["_id"])
+                # Assurer que category et subcategory existent
+                if 'category' not in book_data:
+                    book_data['category'] = None
+                if 'subcategory' not in book_data:
+                    book_data['subcategory'] = None
+                books[book_data["pdf_path"]] = DBBook.from_dict(book_data).to_dict()
+            return books
+        except Exception as e:
+            logging.error(f"Erreur lors de la récupération des livres par filename : {e}")
+            return {}
+
     def get_book_by_title(self, title):
         """
         Récupère un livre par son titre.
@@ -232,10 +290,18 @@ class BookService:
         Args:
             title (str): Titre du livre à rechercher
             
+        Les livres trouvés sont conservés BOOK_CACHE_TTL secondes dans book_title_cache :
+        les routes de descriptions et de similarité, appelées en rafale sur un même livre,
+        ne refont pas la requête MongoDB à chaque appel.
+
         Returns:
             dict: Données du livre ou None si non trouvé
         """
         try:
+            cached = book_title_cache.get(title)
+            if cached and cached[0] > time.monotonic():
+                return dict(cached[1])
+
             book_data = self.books_collection.find_one({"title": title})
             if book_data:
                 book_data["_id"] = str(book_data["_id"])
@@ -244,7 +310,9 @@ class BookService:
                     book_data['category'] = None
                 if 'subcategory' not in book_data:
                     book_data['subcategory'] = None
-                return DBBook.from_dict(book_data).to_dict()
+                book = DBBook.from_dict(book_data).to_dict()
+                book_title_cache.put(title, (time.monotonic() + BOOK_CACHE_TTL, book))
+                return dict(book)
             return None
         except Exception as e:
             logging.error(f"Erreur lors de la récupération du livre par titre : {e}")
@@ -278,6 +346,7 @@ class BookService:
                         "description_embedding_date": timestamp
                     }}
                 )
+                self._invalidate_caches()
                 if update_result.modified_count > 0:
                     logging.info(f"Embedding mis à jour pour le livre {book_id}")
                 else:
@@ -302,6 +371,7 @@ class BookService:
                     "description_embedding_date": ""
                 }}
             )
+            self._invalidate_caches()
             if update_result.modified_count > 0:
                 logging.info(f"Embedding supprimé pour le livre {book_id}")
             else:
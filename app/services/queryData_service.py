@@ -1,9 +1,152 @@
 from ..mongoClient import Client
 from bson import ObjectId
+from threading import Lock
 import logging
-import torch
-from sentence_transformers import util
-from ..utils.text_utils import contain_key
+import time
+import numpy as np
+from ..utils.text_utils import compile_keyword_filter, normalize_text
+from ..utils.vector_utils import normalize_query_vector
+
+# Intervalle (secondes) entre deux vérifications du nombre de requêtes sauvegardées
+QUERY_INDEX_CHECK_INTERVAL = 30
+
+class QueryVectorIndex:
+    """
+    Index en mémoire des vecteurs des requêtes sauvegardées.
+
+    Les vecteurs sont chargés depuis MongoDB (sans les réponses) dans une matrice float32
+    L2-normalisée, construite en un seul np.stack, puis complétés à chaque sauvegarde dans
+    un tampon dont la capacité double lorsqu'il est plein. La recherche se réduit à un
+    produit matrice-vecteur, au lieu de relire toute la collection et de calculer une
+    similarité par document à chaque requête.
+
+    Chaque processus gunicorn possède son propre index : au plus toutes les
+    QUERY_INDEX_CHECK_INTERVAL secondes, le nombre de documents de la collection est
+    comparé à celui de l'index, et l'index est rechargé s'il diffère (requêtes sauvegardées
+    par un autre processus, documents supprimés). invalidate() force ce rechargement
+    lorsqu'un identifiant de l'index n'existe plus en base.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.load_lock = Lock()
+        self.loaded = False
+        self.ids = []
+        self.normalized_queries = []
+        self.buffer = None
+        self.size = 0
+        self.document_count = 0
+        self.next_check = 0.0
+
+    @staticmethod
+    def _normalized_query(query):
+        normalized = normalize_text(query)
+        return normalized, frozenset(normalized.split())
+
+    def _is_stale(self, collection):
+        with self.lock:
+            if not self.loaded:
+                return True
+            if time.monotonic() < self.next_check:
+                return False
+            self.next_check = time.monotonic() + QUERY_INDEX_CHECK_INTERVAL
+            document_count = self.document_count
+        return collection.estimated_document_count() != document_count
+
+    def ensure_loaded(self, collection):
+        """
+        Charge les vecteurs des requêtes sauvegardées au premier appel, puis les recharge
+        si le nombre de documents de la collection a changé depuis le dernier chargement.
+        """
+        with self.load_lock:
+            if not self._is_stale(collection):
+                return
+            # Compté avant la lecture : une sauvegarde concurrente provoquera un nouveau chargement
+            document_count = collection.estimated_document_count()
+            ids, normalized_queries, vectors = [], [], []
+            for mquery in collection.find({}, {"query": 1, "vector_data": 1}):
+                if not mquery.get("vector_data"):
+                    continue
+                vector = normalize_query_vector(mquery["vector_data"])
+                if vectors and vector.shape[0] != vectors[0].shape[0]:
+                    logging.warning(f"Vecteur de requête ignoré (dimension {vector.shape[0]}) : {mquery['_id']}")
+                    continue
+                ids.append(mquery["_id"])
+                normalized_queries.append(self._normalized_query(mquery.get("query", "")))
+                vectors.append(vector)
+            buffer = np.stack(vectors) if vectors else None
+
+            with self.lock:
+                self.ids = ids
+                self.normalized_queries = normalized_queries
+                self.buffer = buffer
+                self.size = len(ids)
+                self.document_count = document_count
+                self.next_check = time.monotonic() + QUERY_INDEX_CHECK_INTERVAL
+                self.loaded = True
+            logging.info(f"Index des requêtes chargé : {len(ids)} vecteurs")
+
+    def invalidate(self):
+        """Force le rechargement de l'index lors du prochain appel à ensure_loaded."""
+        with self.lock:
+            self.loaded = False
+
+    def add(self, query_id, query, vector):
+        """Ajoute une requête sauvegardée à l'index s'il est déjà chargé."""
+        vector = normalize_query_vector(vector)
+        with self.lock:
+            if not self.loaded:
+                return
+            self.document_count += 1
+            if self.buffer is None:
+                self.buffer = np.empty((1, vector.shape[0]), dtype=np.float32)
+            elif self.buffer.shape[1] != vector.shape[0]:
+                logging.warning(f"Vecteur de requête ignoré (dimension {vector.shape[0]}) : {query_id}")
+                return
+            elif self.size == self.buffer.shape[0]:
+                # Nouveau tampon : les vues déjà remises à search() restent valides
+                grown = np.empty((2 * self.size, self.buffer.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.buffer[:self.size]
+                self.buffer = grown
+            self.buffer[self.size] = vector
+            self.size += 1
+            self.ids.append(query_id)
+            self.normalized_queries.append(self._normalized_query(query))
+
+    def search(self, vector, most_words):
+        """
+        Retourne l'identifiant et le score de la requête la plus proche contenant les mots-clés.
+
+        Returns:
+            tuple: (identifiant, score), ou (None, 0) si aucune requête ne correspond
+        """
+        with self.lock:
+            ids = self.ids[:self.size]
+            normalized_queries = self.normalized_queries[:self.size]
+            matrix = self.buffer[:self.size] if self.buffer is not None else None
+        if matrix is None or not ids:
+            return None, 0
+
+        keyword_filter = compile_keyword_filter(most_words)
+        if keyword_filter is None:
+            kept = list(range(len(ids)))
+        else:
+            kept = [
+                i for i, (normalized, words) in enumerate(normalized_queries)
+                if keyword_filter(normalized, words)
+            ]
+        if not kept:
+            return None, 0
+
+        query = normalize_query_vector(vector)
+        if query.shape[0] != matrix.shape[1]:
+            return None, 0
+        scores = matrix[kept] @ query
+        best = int(np.argmax(scores))
+        return ids[kept[best]], float(scores[best])
+
+# Index partagé par toutes les instances du service
+query_vector_index = QueryVectorIndex()
 
 class QueryDataService:
     """
@@ -34,23 +177,21 @@ class QueryDataService:
             dict: La requête la plus similaire trouvée si le score dépasse 0.98, None sinon
         """
         logging.info(f"Recherche de requêtes similaires sur {device}")
-        query_datas = self.collection.find()
-        best_score = 0
-        best_response = None
-
-        for mquery in query_datas:
-            if contain_key(mquery["query"], most_words):
-                f_tensor = torch.tensor(mquery["vector_data"]).to(device)
-                f_tensor_to_compare = torch.tensor(vector_to_compare).to(device)
-                score = util.cos_sim(f_tensor, f_tensor_to_compare).item()
-
-                if score > best_score:
-                    best_score = score
-                    best_response = mquery
-
-        if best_score > 0.98:
-            best_response["_id"] = str(best_response["_id"])
-            return best_response
+        query_vector_index.ensure_loaded(self.collection)
+        best_id, best_score = query_vector_index.search(vector_to_compare, most_words)
+
+        if best_id is not None and best_score > 0.98:
+            best_response = self.collection.find_one({"_id": best_id})
+            if best_response is None:
+                # Requête supprimée depuis le chargement : recharger l'index et rechercher à nouveau
+                query_vector_index.invalidate()
+                query_vector_index.ensure_loaded(self.collection)
+                best_id, best_score = query_vector_index.search(vector_to_compare, most_words)
+                if best_id is not None and best_score > 0.98:
+                    best_response = self.collection.find_one({"_id": best_id})
+            if best_response:
+                best_response["_id"] = str(best_response["_id"])
+                return best_response
         return None
 
     def save_query(self, query, vector_to_compare, response_data):
@@ -74,6 +215,7 @@ class QueryDataService:
                 "downvotes": 0
             }
             result = self.collection.insert_one(query_data)
+            query_vector_index.add(result.inserted_id, query, query_data["vector_data"])
             return str(result.inserted_id)
         except Exception as e:
             logging.error(f"Erreur lors de la sauvegarde de la requête : {e}")
@@ -1,10 +1,18 @@
+import hashlib
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from .cache_utils import ocr_cache
 from .file_utils import save_partial_data
-from .vector_utils import serialize_tensor, vectorize_text
+from .vector_utils import serialize_tensor, vectorize_text, vectorize_texts_batch
 from flask import current_app, json
 from app.models.ai_model import AIModel
-from .model_utils import get_api_key_for_model
+from .model_utils import get_api_key_for_model, with_app_context
+
+# Pool partagé par les requêtes pour les appels LLM de filtrage : les threads sont
+# réutilisés d'une requête à l'autre et le nombre d'appels simultanés reste borné
+LLM_FILTER_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-filter')
 
 def filter_matches_by_llm_batch(passages_batch, query, api_key=None, model_type=None):
     """
@@ -47,63 +55,98 @@ RÉPONSES:"""
     try:
         response = AIModel.generate_response(model_type, api_key, prompt)
         
-        # Analyse des réponses
-        results = []
-        response_lines = response.strip().split('\n')
-        for line in response_lines:
-            if ':' in line:
-                result = line.split(':')[1].strip().upper().startswith('OUI')
-                results.append(result)
+        # Analyse des réponses par numéro de passage
+        decisions = {
+            int(number): verdict.upper() == 'OUI'
+            for number, verdict in re.findall(r'PASSAGE\s*(\d+)\s*:\s*(OUI|NON)', response, re.IGNORECASE)
+        }
                 
-        # Si le nombre de réponses ne correspond pas au nombre de passages
-        if len(results) != len(passages_batch):
-            logging.warning(f"Nombre de réponses incorrect. Attendu: {len(passages_batch)}, Reçu: {len(results)}")
-            return [True] * len(passages_batch)
+        # Les passages non classés par le modèle sont conservés
+        if len(decisions) != len(passages_batch):
+            logging.warning(f"Nombre de réponses incorrect. Attendu: {len(passages_batch)}, Reçu: {len(decisions)}")
             
-        return results
+        return [decisions.get(i + 1, True) for i in range(len(passages_batch))]
         
     except Exception as e:
         logging.error(f"Erreur lors de l'évaluation batch LLM: {e}")
         return [True] * len(passages_batch)
 
-def llm_filter_matches(initial_matches, query, api_key, model_type, send_progress=None):
+def llm_filter_matches(initial_matches, query, api_key, model_type, send_progress=None, batch_size=10,
+                       keep_above=None, drop_below=None):
     """
     Filtre les passages en évaluant plusieurs passages simultanément.
+    
+    Chaque appel au LLM évalue batch_size passages (un seul prompt numéroté), soit
+    ⌈N / batch_size⌉ appels pour N passages.
+    
+    Les lots sont envoyés en parallèle au LLM afin de superposer les latences réseau.
+    Les passages sont regroupés par longueur de texte voisine : les lots ont des
+    prompts de taille homogène et se terminent à peu près en même temps.
+    
+    Si keep_above (resp. drop_below) est fourni, les passages de score strictement
+    supérieur (resp. inférieur) sont conservés (resp. écartés) sans appel au LLM ;
+    seuls les passages entre les deux seuils sont soumis au modèle.
     """
     if send_progress:
         send_progress("Filtrage par LLM des passages retenus...")
-    filtered_matches = []
     
-    # Nombre de passages à évaluer par lot
-    BATCH_SIZE = 5
+    # Passages décidés par leur score, les autres sont évalués par le LLM
+    kept_indices = []
+    to_check = []
+    for i, match in enumerate(initial_matches):
+        if keep_above is not None and match['score'] > keep_above:
+            kept_indices.append(i)
+        elif drop_below is None or match['score'] >= drop_below:
+            to_check.append(i)
+    if len(to_check) < len(initial_matches):
+        logging.info(
+            f"Filtrage par score : {len(kept_indices)} passages conservés, "
+            f"{len(initial_matches) - len(kept_indices) - len(to_check)} écartés sans appel au LLM"
+        )
     
-    # Traitement par lots
-    for i in range(0, len(initial_matches), BATCH_SIZE):
-        batch = initial_matches[i:i + BATCH_SIZE]
-        
+    # Index des passages triés par longueur de texte, découpés en lots
+    by_length = sorted(to_check, key=lambda i: len(initial_matches[i]['text']))
+    index_batches = [by_length[i:i + batch_size] for i in range(0, len(by_length), batch_size)]
+    batches = [[initial_matches[i] for i in indices] for indices in index_batches]
+    
+    # Traitement des lots en parallèle, dans le contexte Flask de l'appelant (configuration des modèles)
+    batch_results = [None] * len(batches)
+    evaluated_count = 0
+    filter_batch = with_app_context(filter_matches_by_llm_batch)
+    future_to_index = {
+        LLM_FILTER_EXECUTOR.submit(filter_batch, batch, query, api_key, model_type): batch_index
+        for batch_index, batch in enumerate(batches)
+    }
+    for future in as_completed(future_to_index):
+        batch_index = future_to_index[future]
         try:
-            results = filter_matches_by_llm_batch(batch, query, api_key, model_type)
-            
-            # Ajouter les passages pertinents aux résultats filtrés
-            for match, is_relevant in zip(batch, results):
-                if is_relevant:
-                    filtered_matches.append(match)
-                    logging.info(f"Page {match['page_num']} conservée (score: {match['score']:.3f})")
-                else:
-                    logging.info(f"Page {match['page_num']} retirée (score: {match['score']:.3f})")
-                    
-            # Mise à jour du progrès
-            if send_progress:
-                progress = (i + len(batch)) / len(initial_matches) * 100
-                send_progress(f"Filtrage LLM: {progress:.1f}% complété...")
-            
+            batch_results[batch_index] = future.result()
         except Exception as e:
-            logging.error(f"Erreur lors du traitement du lot {i//BATCH_SIZE + 1}: {e}")
-            # En cas d'erreur, ajouter tous les passages du lot
-            filtered_matches.extend(batch)
+            logging.error(f"Erreur lors du traitement du lot {batch_index + 1}: {e}")
+        
+        # Mise à jour du progrès
+        evaluated_count += len(batches[batch_index])
+        if send_progress:
+            progress = evaluated_count / len(to_check) * 100
+            send_progress(f"Filtrage LLM: {progress:.1f}% complété...")
+
+    # Index des passages pertinents
+    for indices, results in zip(index_batches, batch_results):
+        if results is None:
+            # En cas d'erreur, conserver tous les passages du lot
+            kept_indices.extend(indices)
+            continue
+        for i, is_relevant in zip(indices, results):
+            match = initial_matches[i]
+            if is_relevant:
+                kept_indices.append(i)
+                logging.info(f"Page {match['page_num']} conservée (score: {match['score']:.3f})")
+            else:
+                logging.info(f"Page {match['page_num']} retirée (score: {match['score']:.3f})")
 
-    # Tri final par numéro de page
-    filtered_matches.sort(key=lambda x: x['page_num'])
+    # Tri final par numéro de page, l'ordre initial départageant les égalités
+    kept_indices.sort(key=lambda i: (initial_matches[i]['page_num'], i))
+    filtered_matches = [initial_matches[i] for i in kept_indices]
     
     logging.info(f"Filtrage LLM terminé: {len(filtered_matches)}/{len(initial_matches)} passages retenus")
     return filtered_matches
@@ -502,7 +545,6 @@ def generate_overall_description(textes, model, existing_description=None, exist
         logging.info("Début de la génération de la description générale")
         # Créer le premier niveau avec les textes des pages et leurs numéros
         page_descriptions = []
-        page_vectors = []
         for page in textes:
             page_info = {
                 'text': page['text'],
@@ -512,9 +554,9 @@ def generate_overall_description(textes, model, existing_description=None, exist
             }
             page_descriptions.append(page_info)
 
-            # Utiliser la fonction commune pour la vectorisation
-            embedding = vectorize_text(page['text'], model, chunk_content=False)
-            page_vectors.append(serialize_tensor(embedding))
+        # Vectoriser toutes les pages en un seul appel batché au modèle
+        page_embeddings = vectorize_texts_batch([page['text'] for page in textes], model)
+        page_vectors = [serialize_tensor(embedding) for embedding in page_embeddings]
 
         general_description.append(page_descriptions)
         descriptions_vectorized.append(page_vectors)
@@ -894,6 +936,9 @@ RÉPONSE COMPLÈTE :"""
 - Approfondir les aspects spécifiques mentionnés
 - Rechercher des informations supplémentaires selon les instructions données"""
 
+# Estimation simple : ~1.3 tokens par mot
+TOKENS_PER_WORD = 1.3
+
 def estimate_tokens(text):
     """
     Estime le nombre de tokens dans un texte.
@@ -901,19 +946,32 @@ def estimate_tokens(text):
     :param text: Texte à évaluer
     :return: Nombre estimé de tokens
     """
-    # Estimation simple : ~1.3 tokens par mot
-    return len(text.split()) * 1.3
+    return len(text.split()) * TOKENS_PER_WORD
 
-def correct_ocr_text(page_text, app):
+def correct_ocr_text(page_text, app, persistent_cache=None):
     """
     Corrige les erreurs OCR dans le texte d'une page.
     
+    Les corrections sont mémorisées par empreinte SHA-256 du texte brut, en mémoire
+    (ocr_cache) et optionnellement dans un cache persistant, afin qu'une page identique
+    ne soit jamais renvoyée deux fois au LLM lors d'une reprise de traitement.
+    
     Args:
         page_text: Texte de la page à corriger
         app: Instance de l'application Flask
+        persistent_cache: Mapping persistant (ex: shelve) partagé entre exécutions (optionnel)
     Returns:
         Texte corrigé
     """
+    cache_key = hashlib.sha256(page_text.encode('utf-8')).hexdigest()
+    cached_text = ocr_cache.get(cache_key)
+    if cached_text is not None:
+        return cached_text
+    if persistent_cache is not None and cache_key in persistent_cache:
+        cached_text = persistent_cache[cache_key]
+        ocr_cache.put(cache_key, cached_text)
+        return cached_text
+
     prompt = f"""En tant qu'expert en correction de textes OCR, corrigez les erreurs potentielles dans le texte suivant 
 tout en préservant son sens et sa structure. Retournez uniquement le texte corrigé, sans commentaires ni explications.
 
@@ -935,6 +993,11 @@ Instructions:
             prompt
         )
         logging.info(correct_ocr_text)
+        # Ne pas mémoriser les réponses vides ou les messages d'erreur du modèle
+        if corrected_text and not corrected_text.startswith("Erreur"):
+            ocr_cache.put(cache_key, corrected_text)
+            if persistent_cache is not None:
+                persistent_cache[cache_key] = corrected_text
         return corrected_text
     except Exception as e:
         logging.error(f"Erreur lors de la correction OCR: {e}")
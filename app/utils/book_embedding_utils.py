@@ -5,8 +5,10 @@ Ce module fournit des fonctions pour calculer, stocker et rechercher des embeddi
 de descriptions de livres pour optimiser la recherche sémantique.
 """
 from datetime import datetime
-from .vector_utils import vectorize_text, serialize_tensor, deserialize_tensor
+from .vector_utils import vectorize_text, serialize_tensor
+from .text_utils import vectorize_query
 from sentence_transformers import util
+import numpy as np
 import torch
 import logging
 
@@ -90,14 +92,8 @@ def search_books_by_embedding(query, all_books, model, top_k=5, threshold=0.5):
         return []
     
     try:
-        # Vectoriser la requête avec le préfixe approprié
-        query_embedding = vectorize_text(
-            query.strip(), 
-            model, 
-            prefix="query: ", 
-            chunk_content=False,
-            use_cache=True
-        )
+        # Vectoriser la requête (préfixe "query: ", cache des vecteurs de requêtes)
+        query_embedding = vectorize_query(query.strip(), model)
         
         # Filtrer les livres qui ont des embeddings et des descriptions
         books_with_embeddings = [
@@ -109,22 +105,24 @@ def search_books_by_embedding(query, all_books, model, top_k=5, threshold=0.5):
             logging.warning("Aucun livre avec embedding trouvé pour la recherche")
             return []
         
-        # Convertir les embeddings stockés en tenseurs
-        book_embeddings = []
+        # Ne garder que les embeddings de la dimension de la requête
+        dim = query_embedding.shape[-1]
+        valid_books = []
         for book in books_with_embeddings:
-            try:
-                embedding_tensor = deserialize_tensor(book['description_embedding'], query_embedding.device)
-                book_embeddings.append(embedding_tensor)
-            except Exception as e:
-                logging.error(f"Erreur de désérialisation pour le livre {book.get('_id')}: {e}")
-                continue
-        
-        if not book_embeddings:
+            if len(book['description_embedding']) == dim:
+                valid_books.append(book)
+            else:
+                logging.error(f"Embedding de dimension invalide pour le livre {book.get('_id')}")
+        books_with_embeddings = valid_books
+        
+        if not books_with_embeddings:
             logging.warning("Aucun embedding valide trouvé")
             return []
         
-        # Calculer les similarités
-        book_embeddings_tensor = torch.stack(book_embeddings)
+        # Calculer les similarités sur une matrice construite et transférée en un bloc
+        book_embeddings_tensor = torch.from_numpy(np.asarray(
+            [book['description_embedding'] for book in books_with_embeddings], dtype=np.float32
+        )).to(query_embedding.device)
         similarities = util.cos_sim(query_embedding, book_embeddings_tensor)
         similarities = similarities.flatten().cpu().numpy()
         
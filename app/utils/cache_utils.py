@@ -184,4 +184,8 @@ class VectorizationCache:
 
 # Instances globales de cache
 memory_cache = LRUCache(capacity=30)
-vector_cache = VectorizationCache(capacity=2000)  # Cache dédié pour les vecteurs d'embedding
\ No newline at end of file
+vector_cache = VectorizationCache(capacity=2000)  # Cache dédié pour les vecteurs d'embedding
+ocr_cache = LRUCache(capacity=500)  # Cache des corrections OCR, indexé par SHA-256 du texte brut
+query_vector_cache = LRUCache(capacity=1024)  # Tenseurs de requêtes non sérialisés, indexés par (requête, chemin du modèle)
+book_title_cache = LRUCache(capacity=256)  # Livres indexés par titre, avec leur date d'expiration (BookService)
+book_list_cache = LRUCache(capacity=2)  # Liste complète des livres, avec ou sans embeddings, et sa date d'expiration
\ No newline at end of file
@@ -9,28 +9,35 @@ pour la reprise de traitement, et la vérification/création de répertoires.
 """
 import os
 import json
+import shutil
+import hashlib
 import logging
-from .cache_utils import LRUCache
+import tempfile
+import numpy as np
+from werkzeug.utils import secure_filename
+from .cache_utils import memory_cache
 from ..models.files_book import FilesBook
 
-# Initialisation d'un cache LRU avec une capacité de 30 éléments
-memory_cache = LRUCache(capacity=30)
+def _get_cache_key(file_path):
+    """
+    Retourne la clé de memory_cache d'un fichier .db (chemin absolu).
+
+    :param file_path: Chemin du fichier .db.
+    :return: Chemin absolu normalisé.
+    """
+    return os.path.abspath(file_path)
 
 def load_processed_data(app, file_name):
     """
     Charge les données traitées depuis le cache en mémoire ou depuis le disque si elles ne sont pas en cache.
 
+    L'entrée en cache est ignorée dès que le .db a été modifié depuis sa lecture
+    (livre réindexé), le fichier est alors relu.
+
     :param app: Instance de l'application Flask pour accéder aux configurations.
     :param file_name: Nom du fichier sans extension .db.
     :return: Instance de FilesBook contenant les données traitées ou None en cas d'erreur.
     """
-    # Tente de récupérer les données depuis le cache en mémoire
-    cached_data = memory_cache.get(file_name)
-    if cached_data:
-        logging.info("Données récupérées depuis le cache en mémoire.")
-        return cached_data
-
-    logging.info(f"Aucune donnée en cache pour : {file_name}. Chargement depuis le fichier.")
     try:
         # Construction du chemin complet vers le fichier .db
         try:
@@ -38,20 +45,90 @@ def load_processed_data(app, file_name):
         except AttributeError:
             folder = app['config']['FOLDER_PATH']  # Copie de configuration
         file_path = os.path.join(folder, f"{file_name}.db")
+        cache_key = _get_cache_key(file_path)
+        mtime = os.path.getmtime(file_path)
+
+        # Tente de récupérer les données depuis le cache en mémoire, si le .db n'a pas été réécrit depuis
+        cached_data = memory_cache.get(cache_key)
+        if cached_data and cached_data[0] == mtime:
+            logging.info("Données récupérées depuis le cache en mémoire.")
+            return cached_data[1]
+
+        logging.info(f"Aucune donnée à jour en cache pour : {file_name}. Chargement depuis le fichier.")
         with open(file_path, 'r', encoding='utf-8') as file:
             data = json.load(file)
         
         # Création d'une instance de FilesBook à partir des données
         book = FilesBook.from_dict(data)
+        load_normalized_vectors(file_path[:-3], book)
         
-        # Ajout des données au cache en mémoire
-        memory_cache.put(file_name, book)
+        # Ajout des données au cache en mémoire, avec la date de modification du .db lu
+        memory_cache.put(cache_key, (mtime, book))
         logging.info(f"Données chargées depuis le fichier et ajoutées au cache pour : {file_name}")
         return book
     except Exception as e:
         logging.error(f"Erreur lors du chargement des données depuis le fichier {file_name}.db : {e}")
         return None
 
+def get_vectors_path(file_name):
+    """
+    Retourne le chemin du fichier .npy contenant la matrice normalisée d'un livre.
+
+    :param file_name: Nom du fichier sans extension .db.
+    :return: Chemin du fichier .npy associé.
+    """
+    return f"{file_name}.vectors.npy"
+
+def save_normalized_vectors(file_name, book):
+    """
+    Écrit à côté du .db la matrice float32 L2-normalisée (.npy) de tous les niveaux empilés.
+
+    Ce fichier est relu par memory-map au chargement : le scoring dispose directement
+    d'une matrice prête à multiplier, sans conversion ni normalisation. La matrice est
+    écrite dans un fichier temporaire puis publiée par os.replace : un memory-map ouvert
+    par un autre thread ou processus garde l'ancien fichier au lieu de lire un fichier
+    tronqué ou en cours d'écriture.
+
+    :param file_name: Nom du fichier sans extension .db.
+    :param book: Instance de FilesBook.
+    """
+    try:
+        matrix, _ = book.get_normalized_matrix()
+        vectors_path = get_vectors_path(file_name)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(vectors_path) or '.', suffix='.npy')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                np.save(out, matrix)
+            # mkstemp crée le fichier en lecture seule pour son propriétaire
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, vectors_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    except Exception as e:
+        logging.error(f"Erreur lors de la sauvegarde de la matrice de vecteurs pour {file_name} : {e}")
+
+def load_normalized_vectors(file_name, book):
+    """
+    Associe au livre la matrice normalisée (.npy) ouverte par memory-map.
+
+    Un fichier absent, plus ancien que le .db ou dont la taille ne correspond pas aux
+    vecteurs du livre est ignoré : la matrice sera alors recalculée à la première requête.
+
+    :param file_name: Nom du fichier sans extension .db.
+    :param book: Instance de FilesBook chargée depuis le .db.
+    """
+    try:
+        vectors_path = get_vectors_path(file_name)
+        if not os.path.exists(vectors_path) or os.path.getmtime(vectors_path) < os.path.getmtime(f"{file_name}.db"):
+            return
+        matrix = np.load(vectors_path, mmap_mode='r')
+        if matrix.dtype == np.float32:
+            book.set_normalized_matrix(matrix)
+    except Exception as e:
+        logging.warning(f"Matrice de vecteurs ignorée pour {file_name} : {e}")
+
 def save_processed_data(file_name, book):
     """
     Sauvegarde les données traitées dans le cache en mémoire et sur le disque.
@@ -63,14 +140,16 @@ def save_processed_data(file_name, book):
     if not isinstance(book, FilesBook):
         book = FilesBook.from_dict(book)
 
-    # Ajoute ou met à jour les données dans le cache en mémoire
-    memory_cache.put(file_name, book)
-
     try:
         # Construction du chemin complet vers le fichier .db
         file_path = f"{file_name}.db"
         with open(file_path, 'w', encoding='utf-8') as file:
             json.dump(book.to_dict(), file, ensure_ascii=False, indent=4)
+        save_normalized_vectors(file_name, book)
+
+        # Ajoute ou met à jour les données dans le cache en mémoire : la nouvelle date
+        # de modification remplace l'entrée éventuellement périmée
+        memory_cache.put(_get_cache_key(file_path), (os.path.getmtime(file_path), book))
         logging.info(f"Données traitées sauvegardées sur le disque pour : {file_name}")
     except Exception as e:
         logging.error(f"Erreur lors de la sauvegarde des données sur le disque pour {file_name}.db : {e}")
@@ -136,6 +215,90 @@ def ensure_directory_exists(directory_path):
             logging.error(f"Erreur lors de la création du répertoire {directory_path} : {e}")
             raise
 
+# Taille des blocs copiés lors de l'enregistrement d'un fichier envoyé (4 Mo)
+UPLOAD_BUFFER_SIZE = 4 * 1024 * 1024
+
+def save_uploaded_file(file_storage, destination_path, buffer_size=UPLOAD_BUFFER_SIZE):
+    """
+    Enregistre un fichier envoyé (werkzeug FileStorage) par blocs de grande taille.
+
+    Le contenu est d'abord écrit dans un fichier temporaire du répertoire de destination,
+    puis publié par os.replace : un fichier partiellement écrit n'est jamais visible
+    sous son nom final (ex: par le thread d'encodage du PDF).
+
+    :param file_storage: Fichier reçu dans request.files.
+    :param destination_path: Chemin final du fichier.
+    :param buffer_size: Taille des blocs lus dans le flux de la requête.
+    """
+    directory = os.path.dirname(destination_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb', buffering=buffer_size) as out:
+            shutil.copyfileobj(file_storage.stream, out, length=buffer_size)
+        # mkstemp crée le fichier en lecture seule pour son propriétaire
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, destination_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def save_uploaded_image(file_storage, directory, buffer_size=UPLOAD_BUFFER_SIZE):
+    """
+    Enregistre une image envoyée sous un nom dérivé de son contenu (empreinte BLAKE2b).
+
+    L'empreinte est calculée pendant la copie par blocs vers un fichier temporaire : une
+    image déjà présente n'est pas dupliquée, le nom envoyé par le client n'est jamais
+    utilisé comme chemin (seule son extension, nettoyée, est conservée), et une image
+    modifiée obtient un nouveau nom au lieu d'écraser une couverture déjà en cache.
+
+    :param file_storage: Fichier reçu dans request.files.
+    :param directory: Répertoire de destination (ex: IMAGE_FOLDER).
+    :param buffer_size: Taille des blocs lus dans le flux de la requête.
+    :return: Nom du fichier enregistré dans directory.
+    """
+    extension = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lower()
+    digest = hashlib.blake2b(digest_size=16)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb', buffering=buffer_size) as out:
+            for chunk in iter(lambda: file_storage.stream.read(buffer_size), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        filename = digest.hexdigest() + extension
+        image_path = os.path.join(directory, filename)
+        if os.path.exists(image_path):
+            # Même contenu déjà enregistré
+            os.remove(temp_path)
+        else:
+            # mkstemp crée le fichier en lecture seule pour son propriétaire
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, image_path)
+        return filename
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def get_processed_data_etag(app_config, file_name):
+    """
+    Retourne un ETag des données traitées d'un livre, sans les charger.
+
+    L'ETag dérive du chemin, de la date de modification et de la taille du .db : il change
+    à chaque sauvegarde (save_processed_data), comme l'entrée de memory_cache.
+
+    :param app_config: Configuration de l'application Flask.
+    :param file_name: Nom du fichier sans extension .db.
+    :return: ETag (chaîne hexadécimale) ou None si le .db est absent.
+    """
+    file_path = get_file_path(app_config, file_name, 'db')
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    key = f"{_get_cache_key(file_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
 def get_file_path(app_config, file_name, file_type='db'):
     """
     Construit le chemin complet pour un fichier.
@@ -1,5 +1,6 @@
 from datetime import datetime
 from PIL import Image
+import io
 import tempfile
 import logging
 import base64
@@ -30,8 +31,9 @@ def convert_pdf_page_to_image(pdf_path, page_number=0, max_width=400, output_for
         # Obtenir la page
         page = doc[page_number]
         
-        # Augmenter la résolution du rendu
-        zoom = 2  # augmente la qualité
+        # Rendu au double de la largeur cible (sur-échantillonnage avant réduction),
+        # plafonné au zoom 2 d'origine : inutile de rastériser la page plus grand
+        zoom = min(2, 2 * max_width / page.rect.width) if page.rect.width else 2
         mat = fitz.Matrix(zoom, zoom)
         pix = page.get_pixmap(matrix=mat)
         
@@ -57,13 +59,45 @@ def convert_pdf_page_to_image(pdf_path, page_number=0, max_width=400, output_for
         if 'doc' in locals():
             doc.close()
             
+def save_image(img, image_path, format='WEBP', **params):
+    """
+    Encode une image PIL en mémoire puis la publie sur le disque en une seule écriture.
+
+    Comme save_uploaded_file, l'image est écrite dans un fichier temporaire du répertoire
+    de destination puis renommée par os.replace : serve_image ne sert jamais une image
+    partiellement écrite, même lorsqu'une couverture est régénérée sous le même nom.
+
+    Args:
+        img (PIL.Image.Image): Image à enregistrer
+        image_path (str): Chemin final de l'image
+        format (str): Format d'encodage PIL ('WEBP' par défaut)
+        **params: Options d'encodage transmises à Image.save (ex: quality=85)
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **params)
+
+    directory = os.path.dirname(image_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.image')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(buffer.getbuffer())
+        # mkstemp crée le fichier en lecture seule pour son propriétaire
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, image_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 def resize_image(image_path, max_size=800):
     """Redimensionne l'image tout en conservant le ratio d'aspect."""
     try:
         with Image.open(image_path) as img:
             img.thumbnail((max_size, max_size))
+            # Conserver le JPEG pour les sources JPEG : évite un encodage PNG (deflate) coûteux
+            suffix = ".jpg" if img.format == "JPEG" and img.mode in ("RGB", "L") else ".png"
             # Utiliser un fichier temporaire pour l'image résizée
-            temp_resized = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+            temp_resized = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
             img.save(temp_resized.name)
             logging.debug(f"Image redimensionnée sauvegardée temporairement à '{temp_resized.name}'.")
             return temp_resized.name
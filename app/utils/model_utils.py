@@ -4,7 +4,8 @@ Utilitaires pour la gestion des modèles d'IA.
 Ce module contient des fonctions utilitaires pour manipuler les modèles d'IA,
 gérer les clés API et faciliter l'interopérabilité entre différents fournisseurs.
 """
-from flask import current_app
+from functools import wraps
+from flask import current_app, has_app_context
 
 def get_api_key_for_model(model_type, config=None):
     """
@@ -41,4 +42,29 @@ def get_api_key_for_model(model_type, config=None):
         return None
         
     # Retourner la valeur de la clé API
-    return config.get(key_name)
\ No newline at end of file
+    return config.get(key_name)
+
+def with_app_context(func):
+    """
+    Rattache une fonction au contexte d'application Flask actif, pour l'exécuter dans un pool.
+
+    Les threads d'un ThreadPoolExecutor n'héritent pas du contexte Flask de l'appelant :
+    current_app y est indisponible et AIModel.get_model ne lit plus la configuration
+    (nom du modèle, URL de l'API). La fonction retournée pousse le contexte de l'application
+    de l'appelant avant chaque appel. Hors contexte, la fonction est retournée telle quelle.
+
+    Args:
+        func (callable): Fonction à exécuter dans un autre thread
+
+    Returns:
+        callable: Fonction exécutée dans le contexte de l'application de l'appelant
+    """
+    if not has_app_context():
+        return func
+    app = current_app._get_current_object()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return wrapper
\ No newline at end of file
@@ -15,6 +15,7 @@ Functions:
     filter_matches_by_score_and_page: Filtre les correspondances par score et numéro de page.
     llm_filter_matches: Filtre les correspondances à l'aide d'un modèle de langage.
     prepare_batches_for_llm: Prépare les lots pour le traitement par le LLM.
+    iter_batches_for_llm: Produit les lots au fil de leur préparation.
     process_batch: Traite un lot de données pour générer une réponse partielle.
     generate_partial_responses: Génère des réponses partielles en parallèle.
     merge_all_responses: Fusionne toutes les réponses partielles.
@@ -22,18 +23,30 @@ Functions:
 """
 
 import logging
-import torch
-from sentence_transformers import util
+import os
+from itertools import chain
+import numpy as np
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from .text_utils import contain_key, search_upper_words, search_named_entities_smart, vectorize_query
+from .text_utils import (
+    compile_keyword_selector,
+    parse_page_num,
+    search_upper_words,
+    search_named_entities_smart,
+    vectorize_query,
+)
 from .ai_utils import (
-    estimate_tokens,
+    TOKENS_PER_WORD,
     generate_ai_response,
     generate_combined_documentation,
     merge_responses,
     llm_filter_matches,
 )
 from .file_utils import load_processed_data
+from .model_utils import with_app_context
+from .vector_utils import cosine_scores, normalize_query_vector
+
+# Pool partagé par les requêtes pour la génération des réponses partielles par le LLM
+GENERATION_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-generation')
 
 def extract_keywords(query, send_progress, use_ner=True):
     """
@@ -66,7 +79,9 @@ def vectorize_user_query(query, model, send_progress):
     Vectorise une requête utilisateur à l'aide d'un modèle d'embedding.
     
     Transforme la requête textuelle en un vecteur numérique pour permettre
-    la comparaison avec les vecteurs des documents.
+    la comparaison avec les vecteurs des documents. vectorize_query met en cache
+    les vecteurs de requêtes : les requêtes répétées par process_query et
+    get_relevant_sources_simple ne repassent pas par le modèle.
     
     Args:
         query (str): La requête utilisateur à vectoriser.
@@ -117,168 +132,293 @@ def check_cache(query, most_words, vector_to_compare, query_service, device, new
         logging.info("No cached response found")
     return None
 
-def load_and_score_files(app, files, vector_to_compare, most_words, send_progress):
+def _rank_matches(scores, page_nums, max_matches):
+    """
+    Classe les correspondances par score décroissant puis par page, limitées aux max_matches premières.
+    
+    np.partition donne le score de la max_matches-ième correspondance : seules celles qui
+    l'atteignent (égalités comprises) passent par np.lexsort, stable à égalité.
+    
+    Args:
+        scores (np.ndarray): Scores des correspondances.
+        page_nums (np.ndarray): Numéros de page alignés sur scores.
+        max_matches (int): Nombre maximal de correspondances retenues.
+        
+    Returns:
+        np.ndarray: Index des correspondances retenues, dans l'ordre du classement.
+    """
+    if max_matches <= 0:
+        return np.empty(0, dtype=np.intp)
+    if max_matches < len(scores):
+        threshold = np.partition(scores, len(scores) - max_matches)[len(scores) - max_matches]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((page_nums[candidates], -scores[candidates]))][:max_matches]
+
+def _score_file(app, file, vector_to_compare, most_words, send_progress, top_k=None):
+    """
+    Charge un fichier traité et calcule le score de ses feuilles et de ses nœuds d'arbre.
+    
+    Les nœuds retenus de tous les niveaux sont scorés en un seul produit matrice-vecteur
+    sur la matrice empilée du livre. Lorsque top_k est fourni, seuls les top_k meilleurs
+    nœuds du livre (même classement que filter_matches_by_score_and_page) deviennent des
+    correspondances : aucun dictionnaire n'est créé pour les autres.
+    
+    Args:
+        app (dict): Copie de configuration de l'application (voir extract_config).
+        file (str): Chemin du fichier à analyser.
+        vector_to_compare (torch.Tensor): Vecteur de la requête utilisateur.
+        most_words (list): Mots-clés devant apparaître dans les passages retenus.
+        send_progress (callable): Fonction de callback pour signaler la progression.
+        top_k (int, optional): Nombre maximal de correspondances conservées pour le fichier.
+        
+    Returns:
+        tuple: (leaf_matches, tree_matches, loaded_book), ou None si le fichier n'a pas pu être chargé.
+    """
+    leaf_matches = []
+    tree_matches = []
+
+    send_progress(f"Chargement du fichier {file}...")
+    logging.info(f"\nProcessing file: {file}")
+    loaded_book = load_processed_data(app, file)
+    if loaded_book is None:
+        logging.warning(f"Unable to load data for: {file}")
+        return None
+
+    logging.info(f"Data loaded successfully for: {file}")
+    send_progress(f"Analyse des pages du fichier {file}...")
+
+    # Requête et mots-clés préparés une fois ; matrice et textes normalisés sont conservés sur le livre
+    query = normalize_query_vector(vector_to_compare)
+    keyword_selector = compile_keyword_selector(most_words)
+    matrix, offsets = loaded_book.get_normalized_matrix()
+    levels = loaded_book.descriptions[:len(offsets) - 1]
+
+    # Nœuds retenus par niveau, puis leurs lignes dans la matrice de tout le livre
+    kept_by_level = []
+    for level_idx, level in enumerate(levels):
+        logging.info(f"Analyzing level {level_idx} with {len(level)} nodes")
+        if keyword_selector is None:
+            kept = np.arange(len(level))
+        else:
+            kept = keyword_selector(loaded_book.get_keyword_index(level_idx))
+        logging.info(f"Nodes containing keywords: {len(kept)}")
+        kept_by_level.append(kept)
+
+    total_kept = sum(len(kept) for kept in kept_by_level)
+    if total_kept == 0:
+        return leaf_matches, tree_matches, loaded_book
+    if total_kept < offsets[-1]:
+        rows = np.concatenate([
+            np.asarray(kept, dtype=np.intp) + offsets[level_idx]
+            for level_idx, kept in enumerate(kept_by_level)
+        ])
+        scores = cosine_scores(matrix[rows], query, normalized=True)
+    else:
+        scores = cosine_scores(matrix, query, normalized=True)
+
+    # Niveau, nœud et page de chaque ligne scorée, dans l'ordre des niveaux
+    level_ids = np.repeat(np.arange(len(kept_by_level)), [len(kept) for kept in kept_by_level])
+    node_ids = np.concatenate([np.asarray(kept, dtype=np.intp) for kept in kept_by_level])
+    page_nums = np.concatenate([
+        np.asarray(loaded_book.get_page_nums(level_idx), dtype=np.int64)[np.asarray(kept, dtype=np.intp)]
+        for level_idx, kept in enumerate(kept_by_level)
+    ])
+
+    if top_k is not None and 0 < top_k < total_kept:
+        selected = np.sort(_rank_matches(scores, page_nums, top_k))
+    else:
+        selected = np.arange(total_kept)
+
+    for j in selected:
+        level_idx = int(level_ids[j])
+        node = levels[level_idx][node_ids[j]]
+        matches = leaf_matches if level_idx == 0 else tree_matches
+        matches.append({
+            'text': node['text'],
+            'score': float(scores[j]),
+            'page_range': node['page_range'],
+            'page_num': int(page_nums[j]),
+            'file': file
+        })
+
+    logging.info(f"Leaf level matches after scoring: {len(leaf_matches)}")
+    logging.info(f"Tree level matches after scoring: {len(tree_matches)}")
+
+    return leaf_matches, tree_matches, loaded_book
+
+def load_and_score_files(app, files, vector_to_compare, most_words, send_progress, top_k=None):
+    """
+    Charge chaque fichier et agrège les correspondances feuilles et arbre.
+    
+    Le scoring d'un fichier est isolé dans _score_file et les fichiers, indépendants,
+    sont traités en parallèle par un pool de threads (lecture disque et calcul NumPy
+    relâchent le GIL). Les résultats sont fusionnés dans l'ordre de files. Un pool de
+    processus n'est pas utilisé : le cache mémoire des FilesBook (memory_cache) et les
+    modèles (spaCy, embeddings) sont propres au processus.
+    
+    Lorsque top_k est fourni (nombre de passages finalement retenus), chaque livre ne
+    renvoie que ses top_k meilleurs nœuds, tous niveaux confondus et classés comme dans
+    filter_matches_by_score_and_page : le top-k global est nécessairement inclus dans
+    cette sélection.
+    
+    Returns:
+        tuple: (leaf_matches, tree_matches, file_books)
+    """
     leaf_matches = []
     tree_matches = []
     file_books = {}
-    device = app['config']['device']
-
-    for file in files:
-        send_progress(f"Chargement du fichier {file}...")
-        logging.info(f"\nProcessing file: {file}")
-        loaded_book = load_processed_data(app, file)
-        if loaded_book is None:
-            logging.warning(f"Unable to load data for: {file}")
-            continue
 
-        logging.info(f"Data loaded successfully for: {file}")
-        send_progress(f"Analyse des pages du fichier {file}...")
-
-        # Traitement du niveau feuille (pages)
-        leaf_level = loaded_book.descriptions[0]
-        leaf_vectors = loaded_book.descriptions_vectorized[0]
-        logging.info(f"Analyzing {len(leaf_level)} leaf nodes")
-
-        leaf_matches_count = 0
-        keywords_matches_count = 0
-        for desc, vec in zip(leaf_level, leaf_vectors):
-            if most_words and not contain_key(desc['text'], most_words):
-                continue
-
-            keywords_matches_count += 1
-            score = float(util.cos_sim(
-                torch.tensor(vec).to(device),
-                vector_to_compare.to(device)
-            ))
-
-            leaf_matches.append({
-                'text': desc['text'],
-                'score': score,
-                'page_range': desc['page_range'],
-                'file': file
-            })
-            leaf_matches_count += 1
-
-        logging.info(f"Passages containing keywords: {keywords_matches_count}")
-        logging.info(f"Leaf level matches after scoring: {leaf_matches_count}")
-
-        # Traitement des nœuds de l'arbre
-        for level_idx in range(1, len(loaded_book.descriptions)):
-            level = loaded_book.descriptions[level_idx]
-            vectors = loaded_book.descriptions_vectorized[level_idx]
-            logging.info(f"Analyzing level {level_idx} with {len(level)} nodes")
-
-            tree_matches_count = 0
-            tree_keywords_matches = 0
-            for node, vec in zip(level, vectors):
-                if most_words and not contain_key(node['text'], most_words):
-                    continue
-
-                tree_keywords_matches += 1
-                score = float(util.cos_sim(
-                    torch.tensor(vec).to(device),
-                    vector_to_compare.to(device)
-                ))
-
-                tree_matches.append({
-                    'text': node['text'],
-                    'score': score,
-                    'page_range': node['page_range'],
-                    'file': file
-                })
-                tree_matches_count += 1
-
-            logging.info(f"Tree nodes containing keywords: {tree_keywords_matches}")
-            logging.info(f"Tree level matches after scoring: {tree_matches_count}")
+    if not files:
+        return leaf_matches, tree_matches, file_books
+
+    with ThreadPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as executor:
+        results = list(executor.map(
+            lambda file: _score_file(app, file, vector_to_compare, most_words, send_progress, top_k),
+            files
+        ))
 
+    for file, result in zip(files, results):
+        if result is None:
+            continue
+        file_leaf_matches, file_tree_matches, loaded_book = result
+        leaf_matches.extend(file_leaf_matches)
+        tree_matches.extend(file_tree_matches)
         file_books[file] = loaded_book
 
     return leaf_matches, tree_matches, file_books
 
-def filter_matches_by_score_and_page(leaf_matches, tree_matches, max_page):
-    all_matches = []
-    for match in leaf_matches + tree_matches:
-        try:
-            if 'Pages' in match['page_range']:
-                page_num = int(match['page_range'].split(' ')[1])
-            else:
-                page_num = int(match['page_range'].split(' ')[1])
-        except:
-            page_num = 9999
+def _match_page_num(match):
+    """Retourne le numéro de page d'une correspondance, en le calculant s'il est absent."""
+    page_num = match.get('page_num')
+    if page_num is None:
+        page_num = match['page_num'] = parse_page_num(match['page_range'])
+    return page_num
 
-        match['page_num'] = page_num
-        all_matches.append(match)
-
-    all_matches.sort(key=lambda x: (-x['score'], x['page_num']))
+def filter_matches_by_score_and_page(leaf_matches, tree_matches, max_page):
+    """
+    Retient les max_page meilleures correspondances, par score décroissant puis par page.
+    
+    Le numéro de page est calculé à la création des correspondances (_score_file) ;
+    le classement (_rank_matches) porte sur les tableaux de scores et de pages.
+    """
+    leaf_count = len(leaf_matches)
+    count = leaf_count + len(tree_matches)
+    if not count:
+        return []
 
+    scores = np.fromiter(
+        (match['score'] for match in chain(leaf_matches, tree_matches)), dtype=np.float64, count=count
+    )
+    page_nums = np.fromiter(
+        (_match_page_num(match) for match in chain(leaf_matches, tree_matches)), dtype=np.int64, count=count
+    )
     MAX_MATCHES = int(max_page)
-    return all_matches[:MAX_MATCHES]
+    return [
+        leaf_matches[i] if i < leaf_count else tree_matches[i - leaf_count]
+        for i in _rank_matches(scores, page_nums, MAX_MATCHES)
+    ]
 
 # Suppression du wrapper et import direct de la fonction pour éviter la duplication
 
+def _group_matches_by_file(matches, file_books):
+    """
+    Regroupe les correspondances par fichier, dans l'ordre de première apparition.
+    
+    Returns:
+        list: Documents {'filename', 'description', 'matches'} pour generate_combined_documentation
+    """
+    temp_docs = {}
+    for match in matches:
+        file = match['file']
+        if file not in temp_docs:
+            temp_docs[file] = {
+                'filename': file,
+                'description': file_books[file].description,
+                'matches': []
+            }
+        temp_docs[file]['matches'].append(match)
+    return list(temp_docs.values())
+
+def _count_words(text):
+    return len(text.split())
+
 def prepare_batches_for_llm(query, all_matches, file_books, send_progress):
+    """
+    Répartit les correspondances en lots dont la documentation tient dans le budget de tokens.
+    
+    Returns:
+        list: Lots produits par iter_batches_for_llm.
+    """
+    return list(iter_batches_for_llm(query, all_matches, file_books, send_progress))
+
+def iter_batches_for_llm(query, all_matches, file_books, send_progress):
+    """
+    Produit un à un les lots de correspondances dont la documentation tient dans le budget de tokens.
+    
+    Chaque lot est produit dès qu'il est complet : generate_partial_responses peut lancer
+    sa génération pendant la préparation des lots suivants.
+    
+    estimate_tokens compte les mots séparés par des blancs et chaque fragment de la
+    documentation générée est délimité par des blancs : le nombre de mots d'un lot est
+    donc la somme de l'en-tête, d'un bloc par fichier et d'un bloc par correspondance.
+    Ces contributions sont calculées une fois chacune et cumulées au fil de l'empilement,
+    la documentation n'étant générée qu'une fois par lot émis.
+    """
     send_progress("Préparation des lots pour la génération de la réponse...")
-    main_stack = all_matches.copy()
     virtual_stack = []
-    batches_to_process = []
-
-    while main_stack:
-        current_match = main_stack.pop(0)
-        virtual_stack.append(current_match)
-
-        temp_docs = {}
-        for match in virtual_stack:
-            file = match['file']
-            if file not in temp_docs:
-                temp_docs[file] = {
-                    'filename': file,
-                    'description': file_books[file].description,
-                    'matches': []
-                }
-            temp_docs[file]['matches'].append(match)
-
-        documentation = generate_combined_documentation(temp_docs.values())
-        estimated_tokens = estimate_tokens(documentation)
-
-        if estimated_tokens > 14000:
-            virtual_stack.pop()
-            main_stack.insert(0, current_match)
-
-            documentation = generate_combined_documentation([{
-                'filename': doc['filename'],
-                'description': doc['description'],
-                'matches': doc['matches']
-            } for doc in temp_docs.values()])
-
-            batch_data = {
-                'query': query,
-                'documentation': documentation,
-                'additional_instructions': ""  # Instructions supplémentaires vides pour les lots initiaux
-            }
-            batches_to_process.append(batch_data)
-            virtual_stack = []
 
-    if virtual_stack:
-        temp_docs = {}
-        for match in virtual_stack:
-            file = match['file']
-            if file not in temp_docs:
-                temp_docs[file] = {
-                    'filename': file,
-                    'description': file_books[file].description,
-                    'matches': []
-                }
-            temp_docs[file]['matches'].append(match)
-
-        documentation = generate_combined_documentation(temp_docs.values())
-        batch_data = {
+    header_words = _count_words(generate_combined_documentation([]))
+    empty_doc_words = _count_words(generate_combined_documentation([
+        {'filename': '', 'description': '', 'matches': []}
+    ]))
+    file_words = {}
+
+    def match_words(match):
+        doc = {'filename': '', 'description': '', 'matches': [match]}
+        return _count_words(generate_combined_documentation([doc])) - empty_doc_words
+
+    def added_words(match, stacked_files):
+        file = match['file']
+        words = match_words(match)
+        if file not in stacked_files:
+            if file not in file_words:
+                file_words[file] = _count_words(generate_combined_documentation([
+                    {'filename': file, 'description': file_books[file].description, 'matches': []}
+                ])) - header_words
+            words += file_words[file]
+        return words
+
+    def make_batch(matches):
+        return {
             'query': query,
-            'documentation': documentation,
+            'documentation': generate_combined_documentation(_group_matches_by_file(matches, file_books)),
             'additional_instructions': ""  # Instructions supplémentaires vides pour les lots initiaux
         }
-        batches_to_process.append(batch_data)
 
-    return batches_to_process
+    current_words = header_words
+    stacked_files = set()
+
+    for current_match in all_matches:
+        words = added_words(current_match, stacked_files)
+
+        # Le lot courant est émis tel quel (il tient dans le budget) et la correspondance
+        # qui l'aurait fait déborder ouvre le lot suivant ; une correspondance dépassant
+        # seule le budget forme son propre lot
+        if virtual_stack and (current_words + words) * TOKENS_PER_WORD > 14000:
+            yield make_batch(virtual_stack)
+            virtual_stack = []
+            current_words = header_words
+            stacked_files = set()
+            words = added_words(current_match, stacked_files)
+
+        virtual_stack.append(current_match)
+        current_words += words
+        stacked_files.add(current_match['file'])
+
+    if virtual_stack:
+        yield make_batch(virtual_stack)
 
 def process_batch(batch_data, api_key, model_type):
     try:
@@ -297,36 +437,43 @@ def process_batch(batch_data, api_key, model_type):
         return None
 
 def generate_partial_responses(batches_to_process, api_key, model_type_for_response, send_progress):
+    """
+    Génère en parallèle une réponse partielle par lot.
+    
+    batches_to_process peut être un itérateur (iter_batches_for_llm) : chaque lot est
+    soumis au pool dès qu'il est produit.
+    """
     send_progress("Génération de la réponse par lot...")
     partial_responses = []
-    total_batches = len(batches_to_process)
     completed_count = 0
 
-    with ThreadPoolExecutor() as executor:
-        future_to_batch = {
-            executor.submit(
-                process_batch,
-                batch_data,
-                api_key,
-                model_type_for_response
-            ): batch_data for batch_data in batches_to_process
-        }
-
-        for future in as_completed(future_to_batch):
-            try:
-                response = future.result()
-                completed_count += 1
-                if response:
-                    partial_responses.append(response)
-                    logging.info("Partial response received")
-                    # Envoi de la progression détaillée
-                    send_progress(f"Réception de la réponse partielle {completed_count}/{total_batches}...")
-            except Exception as exc:
-                logging.error(f"Batch generated an exception: {exc}")
-                # On compte tout de même cette tentative de traitement comme terminée
-                # même si elle a échoué, afin de ne pas fausser le décompte
-                send_progress(f"Erreur lors du traitement d'une réponse partielle {completed_count+1}/{total_batches}.")
-                completed_count += 1
+    # Génération dans le contexte Flask de l'appelant (configuration des modèles)
+    generate_batch = with_app_context(process_batch)
+    future_to_batch = {
+        GENERATION_EXECUTOR.submit(
+            generate_batch,
+            batch_data,
+            api_key,
+            model_type_for_response
+        ): batch_data for batch_data in batches_to_process
+    }
+    total_batches = len(future_to_batch)
+
+    for future in as_completed(future_to_batch):
+        try:
+            response = future.result()
+            completed_count += 1
+            if response:
+                partial_responses.append(response)
+                logging.info("Partial response received")
+                # Envoi de la progression détaillée
+                send_progress(f"Réception de la réponse partielle {completed_count}/{total_batches}...")
+        except Exception as exc:
+            logging.error(f"Batch generated an exception: {exc}")
+            # On compte tout de même cette tentative de traitement comme terminée
+            # même si elle a échoué, afin de ne pas fausser le décompte
+            send_progress(f"Erreur lors du traitement d'une réponse partielle {completed_count+1}/{total_batches}.")
+            completed_count += 1
 
     return partial_responses
 
@@ -9,6 +9,7 @@ préparation des données textuelles dans le pipeline RAG.
 """
 import re
 import unicodedata
+import numpy as np
 
 def normalize_text(text):
     """
@@ -69,6 +70,143 @@ def contain_key(text, keywords, use_ner_verification=True):
     # Vérification de la présence de chaque mot-clé dans l'ensemble des mots du texte
     return all(normalize_text(keyword) in text_words for keyword in keywords)
 
+def compile_keyword_filter(keywords):
+    """
+    Prépare une fois par requête le test de présence des mots-clés de contain_key.
+
+    Les mots-clés sont normalisés une seule fois et les expressions sont réunies dans une
+    expression régulière compilée (une alternance parcourue en une passe sur le texte),
+    au lieu de renormaliser chaque mot-clé pour chaque nœud. La sémantique de contain_key
+    est conservée : au moins une entité présente si la vérification NER est disponible,
+    tous les mots-clés présents sinon.
+
+    :param keywords: Liste de mots-clés/entités de la requête.
+    :return: Fonction (texte normalisé, ensemble de ses mots) -> bool, ou None si aucun mot-clé.
+    """
+    if not keywords:
+        return None
+
+    normalized_keywords, phrase_pattern, compound_entities = _prepare_keywords(keywords)
+    if phrase_pattern is False:
+        # Méthode traditionnelle : tous les mots-clés doivent être présents
+        return lambda normalized_text, text_words: all(
+            keyword in text_words for keyword in normalized_keywords
+        )
+
+    def matches(normalized_text, text_words):
+        if phrase_pattern is not None and phrase_pattern.search(normalized_text):
+            return True
+        return any(all(word in text_words for word in words) for words in compound_entities)
+
+    return matches
+
+# Numéro de page suivant le premier mot d'un page_range ("Page 5", "Pages 3 à 7")
+_PAGE_NUM_RE = re.compile(r'^[^ ]* (\d+)(?: |$)')
+
+def parse_page_num(page_range):
+    """
+    Extrait le premier numéro de page d'un page_range ("Page 5", "Pages 3 à 7").
+
+    :param page_range: Plage de pages d'une description.
+    :return: Numéro de page, 9999 si le format n'est pas reconnu.
+    """
+    match = _PAGE_NUM_RE.match(page_range) if isinstance(page_range, str) else None
+    return int(match.group(1)) if match else 9999
+
+# Séparateur des textes dans l'index de mots-clés (retiré par normalize_text, donc absent des mots-clés)
+_KEYWORD_INDEX_SEPARATOR = "\x00"
+
+def _prepare_keywords(keywords):
+    """
+    Normalise les mots-clés et prépare les expressions de la vérification NER.
+
+    :param keywords: Liste de mots-clés/entités de la requête.
+    :return: (mots-clés normalisés, expression compilée des entités ou None, entités composées
+        découpées en mots) ; l'expression vaut False si la vérification NER est indisponible.
+    """
+    normalized_keywords = [normalize_text(keyword) for keyword in keywords]
+    try:
+        from .ner_utils import verify_entities_in_text  # noqa: F401
+    except Exception:
+        return normalized_keywords, False, []
+
+    phrases = sorted({keyword for keyword in normalized_keywords if keyword}, key=len, reverse=True)
+    phrase_pattern = re.compile("|".join(re.escape(phrase) for phrase in phrases)) if phrases else None
+    compound_entities = [keyword.split() for keyword in normalized_keywords if len(keyword.split()) > 1]
+    return normalized_keywords, phrase_pattern, compound_entities
+
+def build_keyword_index(normalized_texts):
+    """
+    Construit l'index de mots-clés d'une liste de textes normalisés.
+
+    L'index réunit les textes en une seule chaîne (pour une recherche d'expressions en une
+    passe) et associe à chaque mot le tableau trié des index des textes qui le contiennent.
+
+    :param normalized_texts: Couples (texte normalisé, ensemble de ses mots).
+    :return: Dictionnaire {'text', 'starts', 'postings', 'size'}.
+    """
+    starts = []
+    position = 0
+    postings = {}
+    for i, (normalized_text, text_words) in enumerate(normalized_texts):
+        starts.append(position)
+        position += len(normalized_text) + len(_KEYWORD_INDEX_SEPARATOR)
+        for word in text_words:
+            postings.setdefault(word, []).append(i)
+    return {
+        'text': _KEYWORD_INDEX_SEPARATOR.join(text for text, _ in normalized_texts),
+        'starts': np.asarray(starts, dtype=np.int64),
+        'postings': {word: np.asarray(ids, dtype=np.int64) for word, ids in postings.items()},
+        'size': len(normalized_texts)
+    }
+
+def _intersect_postings(postings, words):
+    """Retourne les index des textes contenant tous les mots donnés."""
+    ids = None
+    for word in words:
+        word_ids = postings.get(word)
+        if word_ids is None:
+            return np.empty(0, dtype=np.int64)
+        ids = word_ids if ids is None else np.intersect1d(ids, word_ids, assume_unique=True)
+    return ids if ids is not None else np.empty(0, dtype=np.int64)
+
+def compile_keyword_selector(keywords):
+    """
+    Prépare une fois par requête la sélection des textes d'un index de mots-clés.
+
+    Même sémantique que compile_keyword_filter, mais appliquée à un index construit par
+    build_keyword_index : intersection des listes de textes par mot, et une seule recherche
+    d'expressions sur la chaîne de tous les textes, au lieu d'un test par texte.
+
+    :param keywords: Liste de mots-clés/entités de la requête.
+    :return: Fonction (index de mots-clés) -> tableau trié des index retenus, ou None si aucun mot-clé.
+    """
+    if not keywords:
+        return None
+
+    normalized_keywords, phrase_pattern, compound_entities = _prepare_keywords(keywords)
+    if phrase_pattern is False:
+        return lambda keyword_index: _intersect_postings(keyword_index['postings'], normalized_keywords)
+
+    def select(keyword_index):
+        mask = np.zeros(keyword_index['size'], dtype=bool)
+        if phrase_pattern is not None:
+            text = keyword_index['text']
+            starts = keyword_index['starts']
+            match = phrase_pattern.search(text)
+            while match is not None:
+                # Texte contenant l'expression, puis reprise de la recherche au texte suivant
+                i = int(np.searchsorted(starts, match.start(), side='right')) - 1
+                mask[i] = True
+                if i + 1 >= len(starts):
+                    break
+                match = phrase_pattern.search(text, int(starts[i + 1]))
+        for words in compound_entities:
+            mask[_intersect_postings(keyword_index['postings'], words)] = True
+        return np.flatnonzero(mask)
+
+    return select
+
 def split_text_into_chunks(text, model, max_tokens=512, instruction="passage: "):
     """
     Divise un texte en plusieurs morceaux (chunks) de taille maximale définie par `max_tokens`.
@@ -166,13 +304,28 @@ def vectorize_query(query, model):
     les requêtes des autres types de textes, puis convertit le texte en un vecteur
     normalisé adapté pour les calculs de similarité ou d'autres opérations vectorielles.
 
+    Les vecteurs sont conservés sur CPU, sans sérialisation, dans query_vector_cache
+    (clé : texte et chemin du modèle) : une requête répétée ne repasse pas par le modèle.
+    Ce cache remplace celui de vectorize_text, appelé sans cache pour ne pas conserver
+    deux fois le même tenseur.
+
     :param query: Requête utilisateur à vectoriser.
     :param model: Modèle de vectorisation utilisé pour encoder la requête.
-    :return: Vecteur de la requête sous forme de tenseur PyTorch.
+    :return: Vecteur de la requête sous forme de tenseur PyTorch (CPU).
     """
+    from .cache_utils import query_vector_cache
+    # Chemin du modèle chargé : contrairement à id(model), il ne peut pas être réattribué
+    tokenizer = getattr(model, 'tokenizer', None)
+    cache_key = (query, getattr(tokenizer, 'name_or_path', None) or type(model).__qualname__)
+    cached_vector = query_vector_cache.get(cache_key)
+    if cached_vector is not None:
+        return cached_vector
+
     # Utilise la fonction commune de vectorisation du module vector_utils
     from .vector_utils import vectorize_text
-    return vectorize_text(query, model, prefix="query: ", chunk_content=False)
+    query_vector = vectorize_text(query, model, prefix="query: ", chunk_content=False, use_cache=False).cpu()
+    query_vector_cache.put(cache_key, query_vector)
+    return query_vector
 
 def del_pages_number(text):
     """
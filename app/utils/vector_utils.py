@@ -13,7 +13,17 @@ import torch
 from sentence_transformers import util
 import numpy as np
 import logging
+import json
+import threading
+import weakref
 from .cache_utils import vector_cache
+from .file_utils import save_processed_data
+from ..models.files_book import FilesBook, VECTORS_STORAGE_DTYPE
+
+try:
+    import fcntl
+except ImportError:  # Windows : la protection se limite aux threads du processus
+    fcntl = None
 
 def vectorize_text(text, model, prefix="", chunk_content=True, use_cache=True, device=None):
     """
@@ -65,6 +75,136 @@ def vectorize_text(text, model, prefix="", chunk_content=True, use_cache=True, d
             
         return embedding
 
+def vectorize_texts_batch(texts, model, prefix="", batch_size=64, use_cache=True):
+    """
+    Vectorise une liste de textes en un seul appel batché au modèle.
+    
+    Les textes déjà présents dans le cache de vectorisation sont réutilisés ; les autres
+    sont encodés ensemble via model.encode(liste, batch_size=...), ce qui remplace N
+    petites passes du modèle par quelques grandes multiplications matricielles.
+    
+    :param texts: Liste de textes à vectoriser
+    :param model: Modèle d'embedding à utiliser
+    :param prefix: Préfixe optionnel à ajouter à chaque texte (ex: "query: ", "passage: ")
+    :param batch_size: Taille des lots transmis au modèle
+    :param use_cache: Si True, utilise le cache de vectorisation
+    :return: Liste de tenseurs, dans l'ordre des textes fournis
+    """
+    embeddings = [None] * len(texts)
+    missing_indices = []
+
+    for i, text in enumerate(texts):
+        cached_result = vector_cache.get(text, prefix, False) if use_cache else None
+        if cached_result is not None:
+            embeddings[i] = cached_result
+        else:
+            missing_indices.append(i)
+
+    if missing_indices:
+        encoded = model.encode(
+            [prefix + texts[i] for i in missing_indices],
+            batch_size=batch_size,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        for i, embedding in zip(missing_indices, encoded):
+            embeddings[i] = embedding
+            if use_cache:
+                vector_cache.put(texts[i], embedding, prefix, False)
+
+    return embeddings
+
+def vectorize_descriptions(descriptions, model, batch_size=64):
+    """
+    Vectorise toutes les descriptions d'un livre, tous niveaux confondus, en un seul appel batché.
+
+    L'encodage se fait sans suivi des gradients et le résultat est directement une matrice
+    au type de stockage float16, sans passer par des listes Python par vecteur.
+
+    :param descriptions: Liste de niveaux de descriptions (dictionnaires avec 'text' ou chaînes).
+    :param model: Modèle d'embedding à utiliser.
+    :param batch_size: Taille des lots transmis au modèle.
+    :return: Liste de matrices float16 (N, D), une par niveau, alignées sur descriptions.
+    """
+    texts = [
+        desc['text'] if isinstance(desc, dict) else desc
+        for level in descriptions for desc in level
+    ]
+    matrix = np.zeros((0, 0), dtype=VECTORS_STORAGE_DTYPE)
+    if texts:
+        with torch.inference_mode():
+            embeddings = model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        matrix = np.asarray(embeddings, dtype=VECTORS_STORAGE_DTYPE).reshape(len(texts), -1)
+
+    offsets = np.cumsum([0] + [len(level) for level in descriptions])
+    return [matrix[offsets[i]:offsets[i + 1]] for i in range(len(descriptions))]
+
+# Verrous par livre sérialisant le calcul des vecteurs de descriptions manquants entre
+# threads ; une entrée disparaît dès qu'aucun thread ne détient plus son verrou
+_description_vectors_locks = weakref.WeakValueDictionary()
+_description_vectors_locks_guard = threading.Lock()
+
+def _read_description_vectors(db_path):
+    """
+    Relit sur le disque les vecteurs de descriptions d'un livre, éventuellement calculés
+    par un autre processus depuis le chargement de l'instance en mémoire.
+
+    :param db_path: Chemin du fichier de données sans extension .db.
+    :return: Vecteurs des descriptions, ou None s'ils sont absents ou illisibles.
+    """
+    try:
+        with open(f"{db_path}.db", 'r', encoding='utf-8') as file:
+            return FilesBook.from_dict(json.load(file)).descriptions_vectorized or None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Relecture des vecteurs de descriptions impossible pour {db_path}.db : {e}")
+        return None
+
+def ensure_description_vectors(files_book, db_path, model):
+    """
+    Calcule et sauvegarde les vecteurs des descriptions d'un livre s'ils sont absents.
+
+    Le calcul est protégé par un verrou par livre : des requêtes simultanées sur un livre
+    non vectorisé attendent la première au lieu de relancer l'encodage et la sauvegarde.
+    Entre threads, l'instance de FilesBook étant partagée par memory_cache, les suivantes
+    trouvent les vecteurs déjà calculés en reprenant la main. Entre processus gunicorn,
+    un verrou de fichier (fcntl.flock sur <db_path>.vectors.lock, à côté du .vectors.npy)
+    sérialise le calcul, et les vecteurs sauvegardés par un autre processus sont relus
+    depuis le .db au lieu d'être recalculés.
+
+    :param files_book: Instance de FilesBook chargée par load_processed_data.
+    :param db_path: Chemin du fichier de données sans extension .db.
+    :param model: Modèle d'embedding à utiliser.
+    """
+    if files_book.descriptions_vectorized:
+        return
+    with _description_vectors_locks_guard:
+        lock = _description_vectors_locks.get(db_path)
+        if lock is None:
+            lock = threading.Lock()
+            _description_vectors_locks[db_path] = lock
+    with lock, open(f"{db_path}.vectors.lock", 'a') as lock_file:
+        if fcntl is not None:
+            # Libéré à la fermeture du fichier
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if files_book.descriptions_vectorized:
+            return
+        descriptions_vectorized = _read_description_vectors(db_path)
+        if descriptions_vectorized:
+            logging.info("Description vectors loaded from disk (computed by another process)")
+            files_book.descriptions_vectorized = descriptions_vectorized
+            return
+        logging.info("Computing description vectors...")
+        files_book.descriptions_vectorized = vectorize_descriptions(files_book.descriptions, model)
+        save_processed_data(db_path, files_book)
+        logging.info("Description vectors computed and saved")
+
 def calculate_similarity(data, vector_to_compare, device):
     """
     Calcule la similarité entre les vecteurs donnés et un vecteur de comparaison en utilisant la similarité cosinus.
@@ -86,18 +226,18 @@ def calculate_similarity(data, vector_to_compare, device):
 
     # Collecte de tous les vecteurs et suivi de leur index d'élément
     for idx, item in enumerate(data):
-        # Désérialisation des vecteurs stockés et déplacement sur l'appareil spécifié
-        vectors = [deserialize_tensor(vec, device) for vec in item["vector_data"]]
-        all_vectors.extend(vectors)
+        all_vectors.extend(item["vector_data"])
         # Suivi de l'index de l'élément pour chaque vecteur
-        item_indices.extend([idx] * len(vectors))
+        item_indices.extend([idx] * len(item["vector_data"]))
 
     # Vérifie s'il y a des vecteurs à comparer
     if not all_vectors:
         return []
 
-    # Empile tous les vecteurs en un seul tenseur
-    all_vectors_tensor = torch.stack(all_vectors)  # Forme : (nombre_vecteurs, dimension_vecteur)
+    # Empile tous les vecteurs en une seule matrice, transférée en un bloc sur l'appareil
+    all_vectors_tensor = torch.from_numpy(
+        np.asarray(all_vectors, dtype=np.float32)
+    ).to(device)  # Forme : (nombre_vecteurs, dimension_vecteur)
 
     # Calcule les similarités cosinus en une seule opération
     similarities = util.cos_sim(all_vectors_tensor, vector_to_compare)  # Forme : (nombre_vecteurs, 1)
@@ -131,11 +271,50 @@ def deserialize_tensor(tensor_bytes, device):
     """
     Désérialise une liste en un tenseur PyTorch.
 
-    :param tensor_bytes: Liste représentant le tenseur.
+    Les vecteurs stockés en float16 sont convertis en float32 pour le calcul.
+
+    :param tensor_bytes: Liste ou tableau NumPy représentant le tenseur.
     :param device: Appareil ('cpu' ou 'cuda') sur lequel charger le tenseur.
-    :return: Tenseur PyTorch.
+    :return: Tenseur PyTorch (float32).
+    """
+    return torch.tensor(tensor_bytes, dtype=torch.float32).to(device)
+
+def normalize_query_vector(query_vector):
+    """
+    Convertit un vecteur de requête en tableau NumPy float32 de norme 1.
+
+    :param query_vector: Vecteur de la requête (tenseur PyTorch ou tableau NumPy).
+    :return: Tableau NumPy float32 à une dimension, L2-normalisé.
+    """
+    if isinstance(query_vector, torch.Tensor):
+        query_vector = query_vector.detach().to('cpu', torch.float32).numpy()
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    return query / max(float(np.linalg.norm(query)), 1e-8)
+
+def cosine_scores(matrix, query_vector, normalized=False):
     """
-    return torch.tensor(tensor_bytes).to(device)
+    Calcule en un seul produit matrice-vecteur la similarité cosinus entre une requête
+    et toutes les lignes d'une matrice de vecteurs.
+
+    Le calcul passe par NumPy (BLAS) plutôt que par un appel à util.cos_sim par vecteur.
+
+    :param matrix: Matrice (N, D) ou liste de vecteurs (float16 ou float32).
+    :param query_vector: Vecteur de la requête (tenseur PyTorch ou tableau NumPy).
+    :param normalized: Si True, matrice et requête sont déjà L2-normalisées (simple produit scalaire).
+    :return: Tableau NumPy float32 de N scores.
+    """
+    if isinstance(query_vector, torch.Tensor):
+        query_vector = query_vector.detach().to('cpu', torch.float32).numpy()
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return np.zeros(len(matrix), dtype=np.float32)
+    matrix = matrix.reshape(len(matrix), -1)
+    if normalized:
+        return matrix @ query
+
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    return (matrix @ query) / np.maximum(norms, 1e-8)
 
 def get_top_scores(scores, n, threshold):
     """
@@ -183,6 +362,28 @@ def serialize_tensor(tensor):
     """
     return tensor.tolist()
 
+def stack_description_vectors(descriptions_vectorized, device):
+    """
+    Empile les vecteurs de tous les niveaux en une seule matrice transférée en un bloc sur l'appareil.
+
+    Sur GPU, les vecteurs gardent leur type de stockage float16 (moitié moins de données
+    à copier, produits scalaires sur les tensor cores) ; sur CPU ils sont convertis en float32.
+
+    :param descriptions_vectorized: Liste de niveaux (matrices float16 ou listes de vecteurs),
+        ou matrice (N, D) des niveaux déjà empilés (ex: FilesBook.get_normalized_matrix).
+    :param device: Appareil ('cpu' ou 'cuda') sur lequel charger la matrice.
+    :return: Tenseur PyTorch (N, D), vide si aucun vecteur.
+    """
+    dtype = np.float16 if str(device).startswith('cuda') else np.float32
+    if isinstance(descriptions_vectorized, np.ndarray) and descriptions_vectorized.ndim == 2:
+        # Copie en un bloc : la matrice peut être un memory-map en lecture seule
+        return torch.from_numpy(np.array(descriptions_vectorized, dtype=dtype)).to(device)
+    levels = [np.asarray(level, dtype=dtype) for level in descriptions_vectorized if len(level)]
+    if not levels:
+        return torch.empty((0, 0), device=device)
+    matrix = np.vstack([level.reshape(len(level), -1) for level in levels])
+    return torch.from_numpy(matrix).to(device)
+
 def compare_query_to_descriptions(query, descriptions, descriptions_vectorized, model, device):
     """
     Compare une requête aux descriptions en utilisant les vecteurs pré-calculés.
@@ -192,7 +393,8 @@ def compare_query_to_descriptions(query, descriptions, descriptions_vectorized,
 
     :param query: La requête utilisateur.
     :param descriptions: Liste de listes de descriptions.
-    :param descriptions_vectorized: Liste de listes de vecteurs correspondants aux descriptions.
+    :param descriptions_vectorized: Liste de listes de vecteurs correspondants aux descriptions,
+        ou matrice (N, D) de tous les niveaux empilés (voir stack_description_vectors).
     :param model: Modèle utilisé pour vectoriser la requête.
     :param device: Appareil ('cpu' ou 'cuda') pour le calcul des similarités.
     :return: Liste de similarités structurées comme les descriptions.
@@ -200,85 +402,48 @@ def compare_query_to_descriptions(query, descriptions, descriptions_vectorized,
     # Étape 1 : Extraire les mots en majuscules de la requête (excluant le premier mot)
     uppercase_words = search_upper_words(query)
 
-    # Initialiser la structure des similarités avec des zéros 
-    normalized_similarities = [
-        [0.0 for _ in level] for level in descriptions
+    # Aplatir les descriptions (texte de chaque nœud, tous niveaux confondus)
+    flat_descriptions = [
+        desc['text'] if isinstance(desc, dict) else desc
+        for level in descriptions for desc in level
     ]
-
-    # Aplatir les descriptions et les vecteurs
-    flat_descriptions = []
-    for level in descriptions:
-        for desc in level:
-            # Vérifier si desc est un dictionnaire et extraire le texte
-            if isinstance(desc, dict):
-                flat_descriptions.append(desc['text'])
-            else:
-                flat_descriptions.append(desc)
-                
-    flat_vectors = [deserialize_tensor(vec, device) for level in descriptions_vectorized for vec in level]
+    flat_vectors = stack_description_vectors(descriptions_vectorized, device)
 
     # Vectoriser la requête en utilisant notre fonction commune (avec cache)
     query_embedding = vectorize_text(query, model, prefix="query: ", chunk_content=False, device=device)
 
+    # Similarités normalisées à plat, nulles pour les descriptions non retenues
+    flat_similarities = np.zeros(len(flat_descriptions), dtype=np.float64)
     if uppercase_words:
-        # Créer une liste booléenne indiquant si chaque description contient un mot en majuscule
-        contains_uppercase = [contain_key(desc, uppercase_words) for desc in flat_descriptions]
-
-        # Indices des descriptions à traiter
-        indices_to_process = [i for i, contains in enumerate(contains_uppercase) if contains]
-
-        if indices_to_process:
-            # Extraire les vecteurs à traiter
-            matching_embeddings = [flat_vectors[i] for i in indices_to_process]
-
-            # Calculer les similarités
-            similarities = util.cos_sim(query_embedding, torch.stack(matching_embeddings)).cpu().numpy().flatten()
-
-            # Normaliser les similarités entre 0 et 1
-            min_sim = similarities.min()
-            max_sim = similarities.max()
-            if max_sim != min_sim:
-                normalized = (similarities - min_sim) / (max_sim - min_sim)
-            else:
-                normalized = np.zeros_like(similarities)
-
-            # Convertir les similarités normalisées en float natif
-            normalized = [float(sim) for sim in normalized]
-
-            # Réintégrer les similarités normalisées dans la structure 2D
-            cumulative = 0
-            normalized_idx = 0
-            for level_idx, level in enumerate(descriptions):
-                for desc_idx in range(len(level)):
-                    if cumulative in indices_to_process:
-                        sim = normalized[normalized_idx]
-                        normalized_similarities[level_idx][desc_idx] = sim
-                        normalized_idx += 1
-                    cumulative += 1
+        # Indices des descriptions contenant les mots en majuscules
+        indices_to_process = [
+            i for i, desc in enumerate(flat_descriptions) if contain_key(desc, uppercase_words)
+        ]
     else:
-        # Calculer les similarités pour toutes les descriptions
-        if flat_vectors:
-            similarities = util.cos_sim(query_embedding, torch.stack(flat_vectors)).cpu().numpy().flatten()
-
-            # Normaliser les similarités entre 0 et 1
-            min_sim = similarities.min()
-            max_sim = similarities.max()
-            if max_sim != min_sim:
-                normalized = (similarities - min_sim) / (max_sim - min_sim)
-            else:
-                normalized = np.zeros_like(similarities)
-
-            # Convertir les similarités normalisées en float natif
-            normalized = [float(sim) for sim in normalized]
-
-            # Réorganiser les similarités normalisées dans la structure 2D originale
-            idx = 0
-            for level_idx, level in enumerate(descriptions):
-                for desc_idx in range(len(level)):
-                    normalized_similarities[level_idx][desc_idx] = normalized[idx]
-                    idx += 1
-
-    return normalized_similarities
+        indices_to_process = list(range(len(flat_descriptions)))
+
+    if indices_to_process and len(flat_vectors):
+        matching_embeddings = flat_vectors
+        if len(indices_to_process) < len(flat_vectors):
+            matching_embeddings = flat_vectors[torch.as_tensor(indices_to_process, device=flat_vectors.device)]
+
+        # Calculer les similarités en un seul produit matrice-vecteur
+        similarities = util.cos_sim(
+            query_embedding.to(matching_embeddings.dtype), matching_embeddings
+        ).float().cpu().numpy().flatten()
+
+        # Normaliser les similarités entre 0 et 1
+        min_sim = similarities.min()
+        max_sim = similarities.max()
+        if max_sim != min_sim:
+            flat_similarities[indices_to_process] = (similarities - min_sim) / (max_sim - min_sim)
+
+    # Redécouper les similarités selon la structure 2D des descriptions
+    offsets = np.cumsum([0] + [len(level) for level in descriptions])
+    return [
+        flat_similarities[offsets[level_idx]:offsets[level_idx + 1]].tolist()
+        for level_idx in range(len(descriptions))
+    ]
 
 def get_cache_stats():
     """
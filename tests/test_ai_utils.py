@@ -0,0 +1,45 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from app.utils.ai_utils import correct_ocr_text
+from app.utils.cache_utils import ocr_cache
+
+class TestCorrectOcrText(unittest.TestCase):
+    def setUp(self):
+        ocr_cache.clear()
+        self.app = SimpleNamespace(config={"AI_MODEL_TYPE": "vllm_openai"})
+
+    @patch("app.utils.ai_utils.AIModel.generate_response", return_value="Texte corrigé")
+    def test_memory_cache_skips_llm(self, mock_generate):
+        """Une page identique ne doit appeler le LLM qu'une seule fois"""
+        first = correct_ocr_text("Texte brut", self.app)
+        second = correct_ocr_text("Texte brut", self.app)
+
+        self.assertEqual(first, "Texte corrigé")
+        self.assertEqual(second, "Texte corrigé")
+        self.assertEqual(mock_generate.call_count, 1)
+
+    @patch("app.utils.ai_utils.AIModel.generate_response", return_value="Texte corrigé")
+    def test_persistent_cache_is_filled_and_reused(self, mock_generate):
+        """Le cache persistant est alimenté puis réutilisé après vidage du cache mémoire"""
+        shelf = {}
+        correct_ocr_text("Autre texte", self.app, persistent_cache=shelf)
+        self.assertEqual(len(shelf), 1)
+
+        ocr_cache.clear()
+        result = correct_ocr_text("Autre texte", self.app, persistent_cache=shelf)
+        self.assertEqual(result, "Texte corrigé")
+        self.assertEqual(mock_generate.call_count, 1)
+
+    @patch("app.utils.ai_utils.AIModel.generate_response", return_value="Erreur: timeout")
+    def test_errors_are_not_cached(self, mock_generate):
+        """Les messages d'erreur du modèle ne sont pas mémorisés"""
+        shelf = {}
+        correct_ocr_text("Page en erreur", self.app, persistent_cache=shelf)
+        correct_ocr_text("Page en erreur", self.app, persistent_cache=shelf)
+
+        self.assertEqual(shelf, {})
+        self.assertEqual(mock_generate.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
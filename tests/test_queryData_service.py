@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from app.services.queryData_service import QueryVectorIndex
+
+class FakeCollection:
+    """Collection MongoDB minimale : find() et estimated_document_count()"""
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def find(self, filter=None, projection=None):
+        return iter(self.documents)
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+def unit_vector(index, dim=8):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[index] = 1.0
+    return vector.tolist()
+
+class TestQueryVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.collection = FakeCollection([
+            {"_id": "a", "query": "Qui est Victor Hugo ?", "vector_data": unit_vector(0)},
+            {"_id": "b", "query": "Que raconte Germinal ?", "vector_data": unit_vector(1)},
+        ])
+        self.index = QueryVectorIndex()
+
+    def test_load_and_search(self):
+        """Les requêtes sauvegardées sont chargées puis retrouvées par similarité et mots-clés"""
+        self.index.ensure_loaded(self.collection)
+        self.assertEqual(self.index.size, 2)
+
+        best_id, score = self.index.search(np.array(unit_vector(1)), [])
+        self.assertEqual(best_id, "b")
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+        best_id, _ = self.index.search(np.array(unit_vector(1)), ["Hugo"])
+        self.assertEqual(best_id, "a")
+
+    def test_add_grows_buffer(self):
+        """Les ajouts successifs agrandissent le tampon sans perdre de lignes"""
+        self.index.ensure_loaded(self.collection)
+        for i in range(2, 8):
+            self.index.add(f"q{i}", f"requête {i}", unit_vector(i))
+
+        self.assertEqual(self.index.size, 8)
+        self.assertGreaterEqual(self.index.buffer.shape[0], 8)
+        for i in range(2, 8):
+            best_id, _ = self.index.search(np.array(unit_vector(i)), [])
+            self.assertEqual(best_id, f"q{i}")
+
+    def test_reload_when_collection_changes(self):
+        """Une requête supprimée par un autre processus disparaît de l'index après vérification"""
+        self.index.ensure_loaded(self.collection)
+        del self.collection.documents[1]
+
+        with patch("app.services.queryData_service.QUERY_INDEX_CHECK_INTERVAL", 0):
+            self.index.next_check = 0
+            self.index.ensure_loaded(self.collection)
+
+        best_id, _ = self.index.search(np.array(unit_vector(1)), [])
+        self.assertEqual(best_id, "a")
+        self.assertEqual(self.index.size, 1)
+
+    def test_invalidate_forces_reload(self):
+        """invalidate() recharge l'index même si le nombre de documents est inchangé"""
+        self.index.ensure_loaded(self.collection)
+        self.collection.documents[1] = {"_id": "c", "query": "Que raconte Nana ?", "vector_data": unit_vector(1)}
+
+        self.index.invalidate()
+        self.index.ensure_loaded(self.collection)
+
+        best_id, _ = self.index.search(np.array(unit_vector(1)), [])
+        self.assertEqual(best_id, "c")
+
+if __name__ == '__main__':
+    unittest.main()
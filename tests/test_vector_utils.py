@@ -6,13 +6,20 @@ from app.utils.vector_utils import (
     deserialize_tensor,
     serialize_tensor,
     get_top_scores,
+    cosine_scores,
     vectorize_text,
+    vectorize_texts_batch,
 )
 from app.utils.cache_utils import vector_cache
 
 # Création d'une classe mock pour le modèle d'encodage
 class MockModel:
-    def encode(self, text, convert_to_tensor=True, normalize_embeddings=True):
+    def encode(self, text, convert_to_tensor=True, normalize_embeddings=True, batch_size=32, show_progress_bar=False):
+        # Encodage batché : encoder chaque texte et empiler les résultats
+        if isinstance(text, list):
+            self.batch_calls = getattr(self, "batch_calls", 0) + 1
+            embeddings = [self.encode(t, convert_to_tensor, normalize_embeddings) for t in text]
+            return torch.stack(embeddings) if convert_to_tensor else np.stack(embeddings)
         # Simuler l'encodage en générant un vecteur basé sur la longueur du texte
         # C'est seulement pour les tests, ne fera pas d'inférence réelle
         vec_length = 384  # Dimension typique pour les modèles sentence-transformers
@@ -92,6 +99,18 @@ class TestVectorUtils(unittest.TestCase):
             self.assertIsInstance(score["score"], float)
             self.assertTrue(0 <= score["score"] <= 1)
 
+    def test_cosine_scores(self):
+        """Test le scoring matriciel face à util.cos_sim"""
+        from sentence_transformers import util
+        matrix = np.random.RandomState(0).randn(5, 8).astype(np.float16)
+        query = torch.randn(8)
+        scores = cosine_scores(matrix, query)
+
+        expected = util.cos_sim(torch.tensor(matrix, dtype=torch.float32), query)[:, 0]
+        self.assertEqual(scores.shape, (5,))
+        self.assertTrue(np.allclose(scores, expected.numpy(), atol=1e-5))
+        self.assertEqual(len(cosine_scores(np.zeros((0, 8)), query)), 0)
+
     def test_get_top_scores(self):
         """Test la récupération des meilleurs scores"""
         test_scores = [
@@ -195,5 +214,29 @@ class TestVectorUtils(unittest.TestCase):
         self.assertEqual(stats["misses"], 2)
         self.assertEqual(stats["hits"], 1)
 
+    def test_vectorize_texts_batch(self):
+        """Test la vectorisation batchée et sa cohérence avec vectorize_text"""
+        model = MockModel()
+        vector_cache.lru_cache.clear()
+
+        texts = ["Premier passage.", "Deuxième passage.", "Troisième passage."]
+        embeddings = vectorize_texts_batch(texts, model)
+
+        # Un seul appel batché au modèle, un tenseur par texte dans l'ordre
+        self.assertEqual(model.batch_calls, 1)
+        self.assertEqual(len(embeddings), len(texts))
+        for text, embedding in zip(texts, embeddings):
+            expected = model.encode(text)
+            self.assertTrue(torch.allclose(embedding, expected))
+
+        # Les textes sont en cache : un second appel ne sollicite plus le modèle
+        vectorize_texts_batch(texts, model)
+        self.assertEqual(model.batch_calls, 1)
+
+        # Les entrées sont partagées avec vectorize_text (même clé de cache)
+        single = vectorize_text(texts[0], model, chunk_content=False)
+        self.assertTrue(torch.allclose(single, embeddings[0]))
+        self.assertEqual(vector_cache.get_stats()["misses"], 3)
+
 if __name__ == '__main__':
     unittest.main()